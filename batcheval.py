@@ -0,0 +1,52 @@
+"""Score many positions at once with NumPy, using the engine's material and piece-square tables.
+
+Positions are encoded as rows of an (N, 64) int8 array holding the same piece
+codes as Position.squares, so encoding is a copy of each position's bytes.
+"""
+import numpy as np
+
+from engine import SQUARE_SCORES
+from position import BLACK, WHITE, Position
+
+CHUNK_ROWS = 4096  # Rows scored per step; small chunks keep the temporary index array in cache
+
+# SCORE_TABLE[code * 64 + square] is the white-positive score of that piece on that square
+SCORE_TABLE = np.zeros(16 * 64, dtype=np.int16)
+for _code, _scores in enumerate(SQUARE_SCORES):
+    if _scores is not None:
+        SCORE_TABLE[_code * 64:_code * 64 + 64] = _scores
+SQUARE_OFFSETS = np.arange(64, dtype=np.intp)
+
+
+def encode(positions):
+    """Return an (N, 64) int8 array of piece codes and an (N,) bool array that is True where black is to move."""
+    positions = list(positions)
+    squares = np.frombuffer(b''.join(position.squares for position in positions), dtype=np.int8)
+    black_to_move = np.fromiter((position.turn == BLACK for position in positions), dtype=bool, count=len(positions))
+    return squares.reshape(len(positions), 64).copy(), black_to_move
+
+
+def decode(squares, black_to_move=None):
+    """Return a Position for each row of piece codes; castling and en passant rights are not encoded."""
+    squares = np.ascontiguousarray(squares, dtype=np.int8)
+    return [Position(row.tobytes(), BLACK if black_to_move is not None and black_to_move[index] else WHITE)
+            for index, row in enumerate(squares)]
+
+
+def evaluate(squares, black_to_move=None):
+    """Return the scores of an (N, 64) array of piece codes in centipawns as an (N,) int32 array.
+
+    Scores are positive for white, or for the side to move when black_to_move
+    is given, matching engine.evaluate().
+    """
+    squares = np.asarray(squares)
+    scores = np.empty(len(squares), dtype=np.int32)
+    for start in range(0, len(squares), CHUNK_ROWS):
+        chunk = squares[start:start + CHUNK_ROWS]
+        indexes = chunk.astype(np.intp)
+        indexes <<= 6
+        indexes += SQUARE_OFFSETS
+        SCORE_TABLE.take(indexes).sum(axis=1, dtype=np.int32, out=scores[start:start + len(chunk)])
+    if black_to_move is not None:
+        scores[np.asarray(black_to_move, dtype=bool)] *= -1
+    return scores
@@ -0,0 +1,328 @@
+"""Bitboard move generator: a faster drop-in for the rules in position.py.
+
+Square index is row * 8 + col, so bit 0 is the top-left square (row 0, col 0)
+as drawn by ChessBoard, and white pawns move towards lower indices.
+"""
+from position import BLACK, BLACK_BIT, CASTLING_RIGHTS, CODE_PIECES, PIECE_TYPES, PROMOTION_PIECES, WHITE, Move
+
+# Index of each piece type in Bitboards.pieces[color], which is its piece code in position.py minus one
+PAWN_INDEX, KNIGHT_INDEX, BISHOP_INDEX, ROOK_INDEX, QUEEN_INDEX, KING_INDEX = range(len(PIECE_TYPES))
+COLORS = (WHITE, BLACK)
+PIECE_INDEX = {piece_type: index for index, piece_type in enumerate(PIECE_TYPES)}
+COLOR_INDEX = {WHITE: 0, BLACK: 1}
+
+FULL = (1 << 64) - 1
+SQUARE_COORDS = [(sq >> 3, sq & 7) for sq in range(64)]
+KING_HOME = (60, 4)  # e1 and e8
+EP_ROW = (2, 5)  # Row of the en passant square each color can capture onto
+CASTLING = tuple(CASTLING_RIGHTS[color] for color in (WHITE, BLACK))
+
+
+def squares(bits):
+    """Yield the index of every set bit, lowest first."""
+    while bits:
+        lowest = bits & -bits
+        yield lowest.bit_length() - 1
+        bits ^= lowest
+
+
+def _leaper_table(steps):
+    table = []
+    for row, col in SQUARE_COORDS:
+        bits = 0
+        for dx, dy in steps:
+            if 0 <= row + dx < 8 and 0 <= col + dy < 8:
+                bits |= 1 << ((row + dx) * 8 + col + dy)
+        table.append(bits)
+    return table
+
+
+def _ray_table(dx, dy):
+    table = []
+    for row, col in SQUARE_COORDS:
+        bits = 0
+        new_row, new_col = row + dx, col + dy
+        while 0 <= new_row < 8 and 0 <= new_col < 8:
+            bits |= 1 << (new_row * 8 + new_col)
+            new_row += dx
+            new_col += dy
+        table.append(bits)
+    return table
+
+
+KNIGHT_ATTACKS = _leaper_table(((2, 1), (2, -1), (-2, 1), (-2, -1), (1, 2), (1, -2), (-1, 2), (-1, -2)))
+KING_ATTACKS = _leaper_table(((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1)))
+# Squares a pawn of each color attacks from a square
+PAWN_ATTACKS = (_leaper_table(((-1, -1), (-1, 1))), _leaper_table(((1, -1), (1, 1))))
+
+# Rays that grow towards higher square indices stop at their lowest set blocker,
+# rays growing towards lower indices at their highest one.
+ROOK_RAYS_UP = (_ray_table(1, 0), _ray_table(0, 1))
+ROOK_RAYS_DOWN = (_ray_table(-1, 0), _ray_table(0, -1))
+BISHOP_RAYS_UP = (_ray_table(1, 1), _ray_table(1, -1))
+BISHOP_RAYS_DOWN = (_ray_table(-1, -1), _ray_table(-1, 1))
+ALL_RAYS = ROOK_RAYS_UP + ROOK_RAYS_DOWN + BISHOP_RAYS_UP + BISHOP_RAYS_DOWN
+
+
+def _between_table():
+    # BETWEEN[a][b] holds the squares strictly between two squares on a shared line
+    table = [[0] * 64 for _ in range(64)]
+    for rays in ALL_RAYS:
+        for start in range(64):
+            for end in squares(rays[start]):
+                table[start][end] = rays[start] ^ rays[end] ^ (1 << end)
+    return table
+
+
+BETWEEN = _between_table()
+
+
+def _slide(square, occupied, rays_up, rays_down):
+    attacks = 0
+    for table in rays_up:
+        ray = table[square]
+        blockers = ray & occupied
+        if blockers:
+            ray ^= table[(blockers & -blockers).bit_length() - 1]
+        attacks |= ray
+    for table in rays_down:
+        ray = table[square]
+        blockers = ray & occupied
+        if blockers:
+            ray ^= table[blockers.bit_length() - 1]
+        attacks |= ray
+    return attacks
+
+
+def rook_attacks(square, occupied):
+    return _slide(square, occupied, ROOK_RAYS_UP, ROOK_RAYS_DOWN)
+
+
+def bishop_attacks(square, occupied):
+    return _slide(square, occupied, BISHOP_RAYS_UP, BISHOP_RAYS_DOWN)
+
+
+class Bitboards:
+    __slots__ = ('pieces', 'occupied', 'castling', 'ep_square')
+
+    def __init__(self):
+        # pieces[color][piece_type] and occupied[color], color 0 is white
+        self.pieces = [[0] * 6, [0] * 6]
+        self.occupied = [0, 0]
+        self.castling = 0  # Same bit mask as Position.castling
+        self.ep_square = None
+
+    @classmethod
+    def from_position(cls, position):
+        """Build the bitboards from a Position's square codes and rights."""
+        bitboards = cls()
+        bitboards.castling = position.castling
+        if position.ep_square is not None:
+            bitboards.ep_square = position.ep_square[0] * 8 + position.ep_square[1]
+        for sq, code in enumerate(position.squares):
+            if code:
+                color = 1 if code & BLACK_BIT else 0
+                bitboards.pieces[color][(code & 7) - 1] |= 1 << sq
+                bitboards.occupied[color] |= 1 << sq
+        return bitboards
+
+    def piece_on(self, color, square):
+        """Return the type index of the color's piece on a square, or None."""
+        bit = 1 << square
+        if self.occupied[color] & bit:
+            for piece_type, bits in enumerate(self.pieces[color]):
+                if bits & bit:
+                    return piece_type
+        return None
+
+    def is_attacked(self, square, by_color):
+        """Check if any piece of by_color attacks the square."""
+        pieces = self.pieces[by_color]
+        if KNIGHT_ATTACKS[square] & pieces[KNIGHT_INDEX] or KING_ATTACKS[square] & pieces[KING_INDEX]:
+            return True
+        if PAWN_ATTACKS[by_color ^ 1][square] & pieces[PAWN_INDEX]:
+            return True
+        occupied = self.occupied[0] | self.occupied[1]
+        if bishop_attacks(square, occupied) & (pieces[BISHOP_INDEX] | pieces[QUEEN_INDEX]):
+            return True
+        return bool(rook_attacks(square, occupied) & (pieces[ROOK_INDEX] | pieces[QUEEN_INDEX]))
+
+    def in_check(self, color):
+        kings = self.pieces[color][KING_INDEX]
+        return bool(kings) and self.is_attacked(kings.bit_length() - 1, color ^ 1)
+
+    def targets(self, color, piece_type, square):
+        """Return the bitboard of squares a piece can move to, ignoring checks."""
+        own = self.occupied[color]
+        if piece_type == PAWN_INDEX:
+            empty = ~(own | self.occupied[color ^ 1]) & FULL
+            step = -8 if color == 0 else 8
+            bits = PAWN_ATTACKS[color][square] & self.occupied[color ^ 1]
+            ep_square = self.ep_square
+            if ep_square is not None and ep_square >> 3 == EP_ROW[color] and PAWN_ATTACKS[color][square] >> ep_square & 1:
+                bits |= 1 << ep_square
+            one = square + step
+            if 0 <= one < 64 and empty >> one & 1:
+                bits |= 1 << one
+                if square >> 3 == (6 if color == 0 else 1) and empty >> (one + step) & 1:
+                    bits |= 1 << (one + step)
+            return bits
+        if piece_type == KNIGHT_INDEX:
+            return KNIGHT_ATTACKS[square] & ~own
+        if piece_type == KING_INDEX:
+            bits = KING_ATTACKS[square] & ~own
+            if self.castling & (CASTLING[color][0] | CASTLING[color][1]) and square == KING_HOME[color]:
+                bits |= self.castling_targets(color, square)
+            return bits
+        occupied = own | self.occupied[color ^ 1]
+        if piece_type == BISHOP_INDEX:
+            return bishop_attacks(square, occupied) & ~own
+        if piece_type == ROOK_INDEX:
+            return rook_attacks(square, occupied) & ~own
+        return (bishop_attacks(square, occupied) | rook_attacks(square, occupied)) & ~own
+
+    def castling_targets(self, color, square):
+        """Return the king's castling squares; the landing square is left to the legality check."""
+        occupied = self.occupied[0] | self.occupied[1]
+        rooks = self.pieces[color][ROOK_INDEX]
+        kingside, queenside = CASTLING[color]
+        bits = 0
+        if self.is_attacked(square, color ^ 1):
+            return bits
+        if (self.castling & kingside and not occupied & (0b11 << (square + 1)) and rooks >> (square + 3) & 1
+                and not self.is_attacked(square + 1, color ^ 1)):
+            bits |= 1 << (square + 2)
+        if (self.castling & queenside and not occupied & (0b111 << (square - 3)) and rooks >> (square - 4) & 1
+                and not self.is_attacked(square - 1, color ^ 1)):
+            bits |= 1 << (square - 2)
+        return bits
+
+    def is_safe_move(self, color, piece_type, start, end):
+        """Check that moving a piece from start to end does not leave its own king in check."""
+        start_bit, end_bit = 1 << start, 1 << end
+        own, enemy = self.pieces[color], self.pieces[color ^ 1]
+        captured_bit = end_bit
+        if piece_type == PAWN_INDEX and end == self.ep_square:
+            captured_bit = 1 << (end + 8 if color == 0 else end - 8)  # The pawn taken en passant
+        captured = self.piece_on(color ^ 1, captured_bit.bit_length() - 1)
+
+        own[piece_type] ^= start_bit | end_bit
+        self.occupied[color] ^= start_bit | end_bit
+        if captured is not None:
+            enemy[captured] ^= captured_bit
+            self.occupied[color ^ 1] ^= captured_bit
+
+        safe = not self.in_check(color)
+
+        own[piece_type] ^= start_bit | end_bit
+        self.occupied[color] ^= start_bit | end_bit
+        if captured is not None:
+            enemy[captured] ^= captured_bit
+            self.occupied[color ^ 1] ^= captured_bit
+        return safe
+
+    def pinned(self, color):
+        """Return the color's pieces that shield their own king from an enemy slider."""
+        kings = self.pieces[color][KING_INDEX]
+        if not kings:
+            return 0
+        king = kings.bit_length() - 1
+        enemy = self.pieces[color ^ 1]
+        snipers = (rook_attacks(king, self.occupied[color ^ 1]) & (enemy[ROOK_INDEX] | enemy[QUEEN_INDEX])
+                   | bishop_attacks(king, self.occupied[color ^ 1]) & (enemy[BISHOP_INDEX] | enemy[QUEEN_INDEX]))
+        occupied = self.occupied[0] | self.occupied[1]
+        pinned = 0
+        for sniper in squares(snipers):
+            between = BETWEEN[king][sniper] & occupied
+            if between and not between & (between - 1) and between & self.occupied[color]:
+                pinned |= between
+        return pinned
+
+    def legal_targets(self, color, piece_type, square, checked=None, pinned=None):
+        """Return the squares a piece can move to without leaving its own king in check.
+
+        Pass checked and pinned when they are already known, to save recomputing
+        them for every piece of the same side.
+        """
+        targets = self.targets(color, piece_type, square)
+        if checked is None:
+            checked = self.in_check(color)
+        if pinned is None:
+            pinned = self.pinned(color)
+        if piece_type != KING_INDEX and not checked and not pinned >> square & 1:
+            # En passant removes two pawns from one row, which pin detection does not see
+            ep_square = self.ep_square
+            if (piece_type == PAWN_INDEX and ep_square is not None and targets >> ep_square & 1
+                    and not self.is_safe_move(color, piece_type, square, ep_square)):
+                targets ^= 1 << ep_square
+            return targets
+        bits = 0
+        for end in squares(targets):
+            if self.is_safe_move(color, piece_type, square, end):
+                bits |= 1 << end
+        return bits
+
+
+def bitboards(position):
+    """Return the position's bitboards, building them if the board changed since last time."""
+    if position.bitboards is None:
+        position.bitboards = Bitboards.from_position(position)
+    return position.bitboards
+
+
+def piece_moves(position, row, col, piece=None):
+    """Return the squares a piece can reach, ignoring whether its own king is left in check."""
+    piece_type, piece_color = piece or CODE_PIECES[position.squares[row * 8 + col]]
+    bits = bitboards(position).targets(COLOR_INDEX[piece_color], PIECE_INDEX[piece_type], row * 8 + col)
+    return [SQUARE_COORDS[sq] for sq in squares(bits)]
+
+
+def is_king_in_check(position, color):
+    """Check if the king of the specified color is in check."""
+    return bitboards(position).in_check(COLOR_INDEX[color])
+
+
+def is_square_attacked(position, row, col, by_color):
+    """Check if any piece of by_color attacks (row, col)."""
+    return bitboards(position).is_attacked(row * 8 + col, COLOR_INDEX[by_color])
+
+
+def legal_piece_moves(position, row, col):
+    """Return the squares the piece on (row, col) can move to without leaving its king in check."""
+    piece_type, piece_color = CODE_PIECES[position.squares[row * 8 + col]]
+    bits = bitboards(position).legal_targets(COLOR_INDEX[piece_color], PIECE_INDEX[piece_type], row * 8 + col)
+    return [SQUARE_COORDS[sq] for sq in squares(bits)]
+
+
+def has_legal_move(position):
+    """Return True if the side to move has a legal move, stopping at the first piece that can move."""
+    board = bitboards(position)
+    color = COLOR_INDEX[position.turn]
+    checked = board.in_check(color)
+    pinned = board.pinned(color)
+    # The king first, as it is the piece most likely to have a move when in check
+    for piece_type in (KING_INDEX, PAWN_INDEX, KNIGHT_INDEX, BISHOP_INDEX, ROOK_INDEX, QUEEN_INDEX):
+        for start in squares(board.pieces[color][piece_type]):
+            if board.legal_targets(color, piece_type, start, checked, pinned):
+                return True
+    return False
+
+
+def legal_moves(position):
+    """Return every legal Move for the side to move, with one entry per promotion choice."""
+    board = bitboards(position)
+    color = COLOR_INDEX[position.turn]
+    last_row = 0 if color == 0 else 7
+    checked = board.in_check(color)
+    pinned = board.pinned(color)
+    moves = []
+    for piece_type, bits in enumerate(board.pieces[color]):
+        for start in squares(bits):
+            start_coords = SQUARE_COORDS[start]
+            for end in squares(board.legal_targets(color, piece_type, start, checked, pinned)):
+                end_coords = SQUARE_COORDS[end]
+                if piece_type == PAWN_INDEX and end_coords[0] == last_row:
+                    moves.extend(Move(start_coords, end_coords, promotion) for promotion in PROMOTION_PIECES)
+                else:
+                    moves.append(Move(start_coords, end_coords, None))
+    return moves
@@ -1,15 +1,33 @@
+import argparse
+import cProfile
+import pstats
 import pygame
 from pygame.locals import *
 import sys
+import time
+import bitboard
+from engine import EngineWorker
+from history import GameHistory
 from pieces import PieceManager
+from position import PROMOTION_PIECES, Move, Position
+from profiling import Profiler
+from termination import game_over
+from zobrist import TranspositionTable
 
 
-pygame.init()
+ENGINE_POLL_MS = 20  # How often the idle loop checks for the engine's move
+OVERLAY_FONT_SIZE = 18
+MOVE_CACHE_SIZE = 1 << 12  # Positions whose moves the board keeps
+# Plies moved by the arrow and page keys when browsing the game
+NAVIGATION_KEYS = {K_LEFT: -1, K_RIGHT: 1, K_PAGEUP: -10, K_PAGEDOWN: 10}
+
 
 class ChessBoard:
-    def __init__(self, width, height):
+    def __init__(self, width, height, rules=bitboard, resizable=False, engine=None, engine_color='black',
+                 profiler=None, history=None):
         # Set up the display
-        self.screen = pygame.display.set_mode((width, height))
+        pygame.init()
+        self.screen = pygame.display.set_mode((width, height), RESIZABLE if resizable else 0)
         self.width = width
         self.height = height
         self.cell_size = width // 8  # Assuming an 8x8 grid
@@ -18,10 +36,20 @@ class ChessBoard:
         self.WHITE = (115, 149, 82)
         self.BLACK = (235, 236, 208)
 
-        # Track the board state: 2D array for piece positions (None for empty squares)
-        self.board = [[None for _ in range(8)] for _ in range(8)]
+        # Track the board state; the rules live in the headless Position
+        self.position = Position()
+        self.rules = rules  # bitboard, or the position module for the plain reference rules
+
+        # Moves per (row, col, piece) for each position, keyed by its Zobrist key, so
+        # drawing and click handling share them and positions seen again (after a
+        # takeback, while browsing, on a repetition) are not generated twice
+        self.move_cache = TranspositionTable(MOVE_CACHE_SIZE)
         self.current_turn = 'white'  # Start with white's turn
 
+        # Optional EngineWorker that plays engine_color; it searches in the background
+        self.engine = engine
+        self.engine_color = engine_color
+
 
         # Initialize the PieceManager
         self.piece_manager = PieceManager(self.cell_size)
@@ -29,6 +57,12 @@ class ChessBoard:
         # Initialize starting positions for pieces
         self.setup_pieces()
 
+        # Moves played so far; self.ply is the move being shown, len(self.history) when playing live
+        self.history = history if history is not None else GameHistory(self.position)
+        self.ply = 0
+        self.outcome = None  # (result, termination) once the shown position ends the game
+        self.seek(len(self.history))
+
         # Track selected piece and position
         self.selected_piece = None
         self.selected_position = None
@@ -38,261 +72,157 @@ class ChessBoard:
         self.promoting_pawn_position = None
         self.promotion_options = ['queen', 'bishop', 'rook', 'knight']
 
-    def setup_pieces(self):
-        """Set up initial piece positions on the board."""
-        for i in range(8):
-            self.board[1][i] = ('pawn', 'black')  # Black pawns
-            self.board[6][i] = ('pawn', 'white')  # White pawns
-
-        # Setup other pieces for black
-        self.board[0][0] = self.board[0][7] = ('rook', 'black')
-        self.board[0][1] = self.board[0][6] = ('knight', 'black')
-        self.board[0][2] = self.board[0][5] = ('bishop', 'black')
-        self.board[0][3] = ('queen', 'black')
-        self.board[0][4] = ('king', 'black')
+        # Optional profiling.Profiler; F3 toggles its overlay
+        self.profiler = profiler
+        self.overlay_font = None
+        if profiler is not None:
+            profiler.instrument(self)
 
-        # Setup other pieces for white
-        self.board[7][0] = self.board[7][7] = ('rook', 'white')
-        self.board[7][1] = self.board[7][6] = ('knight', 'white')
-        self.board[7][2] = self.board[7][5] = ('bishop', 'white')
-        self.board[7][3] = ('queen', 'white')
-        self.board[7][4] = ('king', 'white')
+    @property
+    def board(self):
+        """Read-only 8x8 view of the rules position, giving None or (piece_type, color) per square."""
+        return self.position.board
 
+    def setup_pieces(self):
+        """Set up initial piece positions on the board."""
+        self.position.setup_pieces()
 
     def highlight_moves(self, piece, row, col):
         """Calculate valid moves for the selected piece."""
-        piece_type, piece_color = piece
-        moves = []
-
-        # Pawn movement logic
-        if piece_type == 'pawn':
-            direction = -1 if piece_color == 'white' else 1  # White moves up, black moves down
-            start_row = 6 if piece_color == 'white' else 1
-            new_row = row + direction
-
-            # Move forward one square
-            if 0 <= new_row < 8 and self.board[new_row][col] is None:
-                moves.append((new_row, col))
-
-            # Move forward two squares from starting position
-            if row == start_row and self.board[new_row][col] is None:
-                new_row_two = row + 2 * direction
-                if 0 <= new_row_two < 8 and self.board[new_row_two][col] is None:
-                    moves.append((new_row_two, col))
-
-            # Capture diagonally
-            for dx in [-1, 1]:
-                if 0 <= new_row < 8 and 0 <= col + dx < 8:
-                    target = self.board[new_row][col + dx]
-                    if target and target[1] != piece_color:
-                        moves.append((new_row, col + dx))
-
-        # Knight movement logic
-        elif piece_type == 'knight':
-            knight_moves = [
-                (2, 1), (2, -1), (-2, 1), (-2, -1),  # Two squares horizontally
-                (1, 2), (1, -2), (-1, 2), (-1, -2)   # Two squares vertically
-            ]
-            for dx, dy in knight_moves:
-                new_row, new_col = row + dx, col + dy
-                if 0 <= new_row < 8 and 0 <= new_col < 8:
-                    if self.board[new_row][new_col] is None or self.board[new_row][new_col][1] != piece_color:
-                        moves.append((new_row, new_col))
-
-
-        # Rook movement logic
-        elif piece_type == 'rook':
-            for d in [-1, 1]:  # Check both directions
-                for step in range(1, 8):  # Move up to 7 squares
-                    new_row = row + d * step
-                    if 0 <= new_row < 8:
-                        if self.board[new_row][col] is None:
-                            moves.append((new_row, col))  # Empty square
-                        else:
-                            if self.board[new_row][col][1] != piece_color:
-                                moves.append((new_row, col))  # Capture
-                            break  # Blocked by another piece
-                    else:
-                        break  # Out of bounds
-
-            for d in [-1, 1]:  # Check left and right
-                for step in range(1, 8):  # Move up to 7 squares
-                    new_col = col + d * step
-                    if 0 <= new_col < 8:
-                        if self.board[row][new_col] is None:
-                            moves.append((row, new_col))  # Empty square
-                        else:
-                            if self.board[row][new_col][1] != piece_color:
-                                moves.append((row, new_col))  # Capture
-                            break  # Blocked by another piece
-                    else:
-                        break  # Out of bounds
-
-        # Bishop movement logic
-        elif piece_type == 'bishop':
-            for d in [-1, 1]:  # Check diagonals
-                for step in range(1, 8):
-                    new_row = row + d * step
-                    new_col = col + d * step
-                    if 0 <= new_row < 8 and 0 <= new_col < 8:
-                        if self.board[new_row][new_col] is None:
-                            moves.append((new_row, new_col))  # Empty square
-                        else:
-                            if self.board[new_row][new_col][1] != piece_color:
-                                moves.append((new_row, new_col))  # Capture
-                            break  # Blocked by another piece
-                    else:
-                        break  # Out of bounds
-
-            for d in [-1, 1]:  # Check the other diagonal
-                for step in range(1, 8):
-                    new_row = row + d * step
-                    new_col = col - d * step
-                    if 0 <= new_row < 8 and 0 <= new_col < 8:
-                        if self.board[new_row][new_col] is None:
-                            moves.append((new_row, new_col))  # Empty square
-                        else:
-                            if self.board[new_row][new_col][1] != piece_color:
-                                moves.append((new_row, new_col))  # Capture
-                            break  # Blocked by another piece
-                    else:
-                        break  # Out of bounds
-
-        # Queen movement logic (combines rook and bishop)
-        elif piece_type == 'queen':
-            # Use rook logic
-            for d in [-1, 1]:  # Check vertical
-                for step in range(1, 8):
-                    new_row = row + d * step
-                    if 0 <= new_row < 8:
-                        if self.board[new_row][col] is None:
-                            moves.append((new_row, col))  # Empty square
-                        else:
-                            if self.board[new_row][col][1] != piece_color:
-                                moves.append((new_row, col))  # Capture
-                            break  # Blocked by another piece
-                    else:
-                        break  # Out of bounds
-
-            for d in [-1, 1]:  # Check horizontal
-                for step in range(1, 8):
-                    new_col = col + d * step
-                    if 0 <= new_col < 8:
-                        if self.board[row][new_col] is None:
-                            moves.append((row, new_col))  # Empty square
-                        else:
-                            if self.board[row][new_col][1] != piece_color:
-                                moves.append((row, new_col))  # Capture
-                            break  # Blocked by another piece
-                    else:
-                        break  # Out of bounds
-
-            # Use bishop logic
-            for d in [-1, 1]:  # Check diagonal
-                for step in range(1, 8):
-                    new_row = row + d * step
-                    new_col = col + d * step
-                    if 0 <= new_row < 8 and 0 <= new_col < 8:
-                        if self.board[new_row][new_col] is None:
-                            moves.append((new_row, new_col))  # Empty square
-                        else:
-                            if self.board[new_row][new_col][1] != piece_color:
-                                moves.append((new_row, new_col))  # Capture
-                            break  # Blocked by another piece
-                    else:
-                        break  # Out of bounds
-
-            for d in [-1, 1]:  # Check the other diagonal
-                for step in range(1, 8):
-                    new_row = row + d * step
-                    new_col = col - d * step
-                    if 0 <= new_row < 8 and 0 <= new_col < 8:
-                        if self.board[new_row][new_col] is None:
-                            moves.append((new_row, new_col))  # Empty square
-                        else:
-                            if self.board[new_row][new_col][1] != piece_color:
-                                moves.append((new_row, new_col))  # Capture
-                            break  # Blocked by another piece
-                    else:
-                        break  # Out of bounds
-
-        # King movement logic
-        elif piece_type == 'king':
-            king_moves = [
-                (1, 0), (-1, 0), (0, 1), (0, -1),
-                (1, 1), (1, -1), (-1, 1), (-1, -1)
-            ]
-            for dx, dy in king_moves:
-                new_row, new_col = row + dx, col + dy
-                if 0 <= new_row < 8 and 0 <= new_col < 8:
-                    if self.board[new_row][new_col] is None or self.board[new_row][new_col][1] != piece_color:
-                        moves.append((new_row, new_col))
-
+        piece_moves = self.move_cache.get(self.position.key)
+        if piece_moves is None:
+            piece_moves = {}
+            self.move_cache.store(self.position.key, piece_moves)
+        key = (row, col, piece)
+        moves = piece_moves.get(key)
+        if moves is None:
+            moves = piece_moves[key] = self.rules.piece_moves(self.position, row, col, piece)
         return moves
 
-         # Add check for pawn promotion
-        if piece[0] == 'pawn' and ((piece[1] == 'white' and row == 0) or (piece[1] == 'black' and row == 7)):
-            self.promoting_pawn_position = (row, col)
-            return []  # Temporarily disable normal moves for the pawn
-
-        return moves  # Continue with other moves
 
-
-    def draw_board(self):
-        """Draw the chessboard and the pieces."""
-        for row in range(8):
-            for col in range(8):
-                color = self.WHITE if (row + col) % 2 == 0 else self.BLACK
-                pygame.draw.rect(self.screen, color, 
+    def record_move(self, move):
+        """Add the move just made on self.position to the history, dropping any moves after the shown ply."""
+        self.history.truncate(self.ply)
+        self.history.append(move, self.position)
+        self.ply = len(self.history)
+        self.check_outcome()
+        if self.outcome:
+            print(f"Game over: {self.outcome[0]} by {self.outcome[1]}.")
+
+    def engine_to_move(self, current_turn):
+        """Whether the engine should move now: only at the end of the game, not while earlier moves are browsed."""
+        return (self.engine is not None and current_turn == self.engine_color
+                and self.ply == len(self.history) and not self.outcome)
+
+    def seek(self, ply):
+        """Show the position after ply moves of the game; playing a move there starts a new line."""
+        ply = max(0, min(ply, len(self.history)))
+        position = self.history.position_at(ply, since_irreversible=True)
+        position.version = self.position.version + 1  # Keep versions rising so cached moves and searches go stale
+        self.position = position
+        self.ply = ply
+        self.check_outcome()
+
+    def check_outcome(self):
+        """Note whether the shown position ends the game, and say so in the window title."""
+        self.outcome = game_over(self.rules, self.position)
+        pygame.display.set_caption(f"Chess - {self.outcome[0]} by {self.outcome[1]}" if self.outcome else "Chess")
+
+    def takeback(self):
+        """Take back the last move, or the last two against the engine so that it is the player's turn again."""
+        ply = len(self.history) - 1
+        if ply < 0:
+            return
+        if self.engine is not None and ply > 0 and self.history.position_at(ply).turn == self.engine_color:
+            ply -= 1
+        self.history.truncate(ply)
+        self.seek(ply)
+
+    def draw_board(self, squares=None):
+        """Draw the chessboard and the pieces, or only the given (row, col) squares."""
+        moves = self.highlight_moves(self.selected_piece, *self.selected_position) if self.selected_position else ()
+        if squares is None:
+            squares = [(row, col) for row in range(8) for col in range(8)]
+        for row, col in squares:
+            color = self.WHITE if (row + col) % 2 == 0 else self.BLACK
+            pygame.draw.rect(self.screen, color, 
+                             (col * self.cell_size, row * self.cell_size, self.cell_size, self.cell_size))
+
+            # Highlight the square if it's a valid move
+            if (row, col) in moves:
+                pygame.draw.rect(self.screen, (0, 255, 0, 128),
                                  (col * self.cell_size, row * self.cell_size, self.cell_size, self.cell_size))
 
-                # Highlight the square if it's a valid move
-                if self.selected_position and (row, col) in self.highlight_moves(self.selected_piece, *self.selected_position):
-                    pygame.draw.rect(self.screen, (0, 255, 0, 128),
-                                     (col * self.cell_size, row * self.cell_size, self.cell_size, self.cell_size))
-
-                # Draw pieces on the board
-                piece = self.board[row][col]
-                if piece:
-                    piece_type, piece_color = piece
-                    self.piece_manager.draw_piece(self.screen, piece_type, piece_color, col, row)
+            # Draw pieces on the board
+            piece = self.position.piece_at(row, col)
+            if piece:
+                piece_type, piece_color = piece
+                self.piece_manager.draw_piece(self.screen, piece_type, piece_color, col, row)
+
+    def render_overlay(self):
+        """Render the profiler's overlay lines and return them with the rect they cover."""
+        if self.overlay_font is None:
+            self.overlay_font = pygame.font.Font(None, OVERLAY_FONT_SIZE)
+        lines = [self.overlay_font.render(line, True, (255, 255, 255)) for line in self.profiler.overlay_lines()]
+        rect = pygame.Rect(0, 0, max(line.get_width() for line in lines) + 8, sum(line.get_height() for line in lines) + 8)
+        return lines, rect
+
+    def draw_overlay(self, lines, rect):
+        """Draw the rendered overlay lines on a dark background in the top left corner."""
+        self.screen.fill((20, 20, 20), rect)
+        y = rect.top + 4
+        for line in lines:
+            self.screen.blit(line, (rect.left + 4, y))
+            y += line.get_height()
+
+    def resize(self, width, height):
+        """Fit the board to a new window size and rescale the piece sprites once."""
+        self.width = width
+        self.height = height
+        self.cell_size = min(width, height) // 8
+        self.piece_manager.set_cell_size(self.cell_size)
 
-    def draw_promotion_popup(self, promotion_position, current_turn, white_pieces, black_pieces):
+    def draw_promotion_popup(self, promotion_position, current_turn):
         """Draws a promotion popup for white and black pawns, positioning options and handling clicks."""
         row, col = promotion_position
         cell_size = self.cell_size
         popup_piece_size = int(cell_size * 0.8)  # Size of the piece images
         padding = int(cell_size * 0.1)  # Padding
 
-        # Determine the pieces available for promotion based on the current turn
-        pieces = white_pieces if current_turn == 'white' else black_pieces
-
         # Store the positions of the promotion options
         self.promotion_option_rects = []
 
-        # Adjust position based on the current turn
-        if current_turn == 'white':
-            start_row = row + 1  # Place options below the promotion row
-            if start_row + 4 > 7:  # Ensure it stays within the board bounds
-                start_row = 7 - 4  # Adjust to fit options
-        else:
-            start_row = row - 4  # Place options above the promotion row
-            if start_row < 0:  # Adjust if it goes out of bounds
-                start_row = 0
+        start_row = self.promotion_start_row(promotion_position, current_turn)
 
         # Draw the promotion options on different blocks (cells)
-        for i, piece_image in enumerate(pieces):
+        for i, piece in enumerate(PROMOTION_PIECES):
             option_row = start_row + i
             popup_x = col * cell_size + padding  # X position (same for all pieces in this column)
             popup_y = option_row * cell_size + padding  # Y position (adjusted by row for each piece)
 
             # Draw the piece option in the popup
-            self.screen.blit(pygame.transform.scale(piece_image, (popup_piece_size, popup_piece_size)), (popup_x, popup_y))
+            piece_image = self.piece_manager.get_sprite(current_turn, piece, popup_piece_size)
+            if piece_image is not None:
+                self.screen.blit(piece_image, (popup_x, popup_y))
 
             # Store the position (rect) for each promotion option for click detection
             rect = pygame.Rect(popup_x, popup_y, popup_piece_size, popup_piece_size)
             self.promotion_option_rects.append(rect)
 
+    def promotion_start_row(self, promotion_position, current_turn):
+        """Return the first row of the promotion options column."""
+        row = promotion_position[0]
+        # Adjust position based on the current turn
+        if current_turn == 'white':
+            start_row = row + 1  # Place options below the promotion row
+            if start_row + 4 > 7:  # Ensure it stays within the board bounds
+                start_row = 7 - 4  # Adjust to fit options
+        else:
+            start_row = row - 4  # Place options above the promotion row
+            if start_row < 0:  # Adjust if it goes out of bounds
+                start_row = 0
+        return start_row
+
     def is_in_promotion_popup(self, mouse_x, mouse_y, promotion_position, current_turn):
         """Check if the mouse is within the bounds of the promotion popup."""
         row, col = promotion_position
@@ -329,59 +259,75 @@ class ChessBoard:
 
     def is_king_in_check(self, color):
         """Check if the king of the specified color is in check."""
-        # Find the king's position
-        king_pos = None
-        for row in range(8):
-            for col in range(8):
-                piece = self.board[row][col]
-                if piece and piece[0] == 'king' and piece[1] == color:
-                    king_pos = (row, col)
-                    break
-            if king_pos:
-                break
-
-        # Check for threats from opponent's pieces
-        opponent_color = 'black' if color == 'white' else 'white'
-        for row in range(8):
-            for col in range(8):
-                piece = self.board[row][col]
-                if piece and piece[1] == opponent_color:
-                    moves = self.highlight_moves(piece, row, col)  # Get potential moves for opponent piece
-                    if king_pos in moves:  # If any opponent piece can move to the king's position
-                        return True  # The king is in check
-
-        return False  # The king is safe
-
-    def run(self):
-        """Main game loop."""
+        return self.rules.is_king_in_check(self.position, color)
+
+    def run(self, fps=60, full_redraw=False):
+        """Main game loop.
+
+        By default the loop sleeps until there is input and then redraws only
+        the squares whose contents changed. fps caps the frame rate (None for
+        no cap) and full_redraw repaints the whole window every frame.
+        """
+        clock = pygame.time.Clock()
+        last_frame = None  # What each square showed when last drawn
         selected_piece = None
         selected_row = None
         selected_col = None
-        current_turn = 'white'  # White starts first
+        current_turn = self.position.turn  # White starts first
         promoting_pawn = False
         promotion_position = None
-
-        # Load images for promotion options for both white and black
-        white_pieces = [
-            pygame.image.load('images/white_queen.png'), 
-            pygame.image.load('images/white_rook.png'), 
-            pygame.image.load('images/white_knight.png'), 
-            pygame.image.load('images/white_bishop.png')
-        ]
-        black_pieces = [
-            pygame.image.load('images/black_queen.png'), 
-            pygame.image.load('images/black_rook.png'), 
-            pygame.image.load('images/black_knight.png'), 
-            pygame.image.load('images/black_bishop.png')
-        ]
+        searched_version = None  # Position version the engine was last asked about
 
         while True:
-            for event in pygame.event.get():
+            if self.engine_to_move(current_turn) and not self.engine.busy and searched_version != self.position.version:
+                self.engine.start(self.position)
+                searched_version = self.position.version
+
+            events = pygame.event.get()
+            if not events and not full_redraw:
+                # Nothing to draw, so sleep until there is input, waking up now and then while the engine thinks
+                events = [pygame.event.wait(ENGINE_POLL_MS if self.engine is not None and self.engine.busy else 0)]
+
+            profiler = self.profiler
+            if profiler:
+                profiler.start_frame()  # Time spent waiting for input is not part of the frame
+
+            for event in events:
                 if event.type == QUIT:
+                    if self.engine is not None:
+                        self.engine.close()
+                    if profiler and profiler.path:
+                        profiler.dump()
                     pygame.quit()
                     sys.exit()
 
-                if event.type == MOUSEBUTTONDOWN:
+                if event.type in (VIDEOEXPOSE, WINDOWEXPOSED):
+                    last_frame = None  # The window was uncovered, repaint everything
+
+                if event.type == KEYDOWN and event.key == K_F3 and profiler:
+                    profiler.overlay = not profiler.overlay
+                    last_frame = None
+
+                if event.type == KEYDOWN and event.key in (K_BACKSPACE, K_HOME, K_END, *NAVIGATION_KEYS):
+                    # Browse the game, or take back the last move
+                    if event.key == K_BACKSPACE:
+                        self.takeback()
+                    elif event.key == K_HOME:
+                        self.seek(0)
+                    elif event.key == K_END:
+                        self.seek(len(self.history))
+                    else:
+                        self.seek(self.ply + NAVIGATION_KEYS[event.key])
+                    selected_piece = None
+                    promoting_pawn = False  # A pawn waiting for its promotion piece is dropped with the old position
+                    current_turn = self.position.turn
+
+                if event.type == VIDEORESIZE:
+                    self.resize(event.w, event.h)
+                    last_frame = None
+
+                # Checked per click: a move earlier in the same batch of events may have handed the turn to the engine
+                if event.type == MOUSEBUTTONDOWN and not self.engine_to_move(current_turn) and not self.outcome:
                     mouse_x, mouse_y = event.pos
                     col = mouse_x // self.cell_size
                     row = mouse_y // self.cell_size
@@ -391,41 +337,39 @@ class ChessBoard:
                         if self.is_in_promotion_popup(mouse_x, mouse_y, promotion_position, current_turn):
                             promoted_piece = self.handle_promotion_selection(mouse_x, mouse_y, promotion_position, current_turn)
                             if promoted_piece:
-                                # Replace the pawn with the promoted piece
-                                self.board[promotion_position[0]][promotion_position[1]] = promoted_piece
+                                # Take back the pawn move and replay it as a promotion
+                                move = self.position.unmake_move()._replace(promotion=promoted_piece[0])
+                                self.position.make_move(move)
+                                self.record_move(move)
                                 promoting_pawn = False  # Reset promotion state
-                                current_turn = 'black' if current_turn == 'white' else 'white'  # Switch turn
+                                current_turn = self.position.turn  # Switch turn
                         continue  # Skip other logic if promoting
 
+                    if not (0 <= row < 8 and 0 <= col < 8):
+                        continue  # A click in the margin of a window that is not square
+
                     # If a piece is already selected
                     if selected_piece is not None:
-                        # Store the current state before the move
-                        previous_piece = self.board[selected_row][selected_col]
-                        previous_target = self.board[row][col]
-
                         if (row, col) in self.highlight_moves(selected_piece, selected_row, selected_col):  # Move piece
-                            # Move the piece
-                            self.board[row][col] = selected_piece  # Place the piece in the new position
-                            self.board[selected_row][selected_col] = None  # Remove it from the old position
-
-                            # Check for pawn promotion
-                            if selected_piece[0] == 'pawn' and (row == 0 or row == 7):
-                                promoting_pawn = True
-                                promotion_position = (row, col)
-                                selected_piece = None  # Deselect to handle promotion properly
+                            # Move the piece; make_move keeps an undo record, including castling and en passant
+                            move = Move((selected_row, selected_col), (row, col), None)
+                            self.position.make_move(move)
 
                             # Check if the king is in check
                             if self.is_king_in_check(current_turn):
-                                # Revert the move if the king is in check
-                                self.board[selected_row][selected_col] = previous_piece
-                                self.board[row][col] = previous_target
+                                # Take the move back if the king is in check
+                                self.position.unmake_move()
                                 # Display a message (optional)
                                 print(f"{current_turn} is in check! Move reverted.")
+                            elif selected_piece[0] == 'pawn' and (row == 0 or row == 7):
+                                # Pawn promotion: the pawn waits on the last row until a piece is picked
+                                promoting_pawn = True
+                                promotion_position = (row, col)
+                                selected_piece = None  # Deselect to handle promotion properly
                             else:
-                                # Switch turn after a move if not in promotion
-                                if not promoting_pawn:
-                                    selected_piece = None  # Clear the selection after move
-                                    current_turn = 'black' if current_turn == 'white' else 'white'
+                                self.record_move(move)
+                                selected_piece = None  # Clear the selection after move
+                                current_turn = self.position.turn
                         else:
                             # Deselect the piece if the click is not a valid move
                             selected_piece = None  # Deselect if it's not a valid move
@@ -437,24 +381,79 @@ class ChessBoard:
                             selected_piece = piece
                             selected_row, selected_col = row, col
 
-            # Fill the screen with white color
-            self.screen.fill(self.WHITE)
+            # Play the engine's move once its search is done, unless the game was browsed or taken back meanwhile
+            if self.engine is not None and self.engine.busy:
+                result = self.engine.poll()
+                if result is not None and self.position.version == searched_version:
+                    if result.move is not None:
+                        self.position.make_move(result.move)
+                        self.record_move(result.move)
+                        current_turn = self.position.turn
+                    print(f"engine: depth {result.depth}, {result.nodes} nodes in {result.seconds:.2f}s "
+                          f"({result.nps:.0f} nps), score {result.score}")
+                    if profiler:
+                        profiler.record_search(result)
+
+            if profiler:
+                profiler.add_time('events', time.perf_counter() - profiler.frame_start)
+
+            # Work out what every square should show
+            outlined = set(self.highlight_moves(selected_piece, selected_row, selected_col)) if selected_piece else set()
+            popup_cells = {}
+            if promoting_pawn:
+                start_row = self.promotion_start_row(promotion_position, current_turn)
+                popup_cells = {(start_row + i, promotion_position[1]): i for i in range(4)}
+            board = list(self.board)
+            frame = {(row, col): (board[row][col], (row, col) in outlined, popup_cells.get((row, col)))
+                     for row in range(8) for col in range(8)}
+
+            if full_redraw or last_frame is None:
+                dirty = list(frame)
+                self.screen.fill(self.WHITE)  # Fill the screen with white color
+            else:
+                dirty = [square for square in frame if frame[square] != last_frame[square]]
+                if popup_cells and any(square in popup_cells for square in dirty):
+                    dirty = list(set(dirty) | set(popup_cells))  # The popup is drawn as one piece
 
-            # Draw the chess board
-            self.draw_board()
+            overlay = None
+            if profiler and profiler.overlay:
+                # The overlay changes every frame, so the squares under it are always redrawn
+                overlay = self.render_overlay()
+                rect = overlay[1]
+                rows = min(8, (rect.bottom - 1) // self.cell_size + 1)
+                cols = min(8, (rect.right - 1) // self.cell_size + 1)
+                dirty = list(set(dirty) | {(row, col) for row in range(rows) for col in range(cols)})
 
-            # Highlight valid moves if a piece is selected
-            if selected_piece:
-                moves = self.highlight_moves(selected_piece, selected_row, selected_col)
-                for move in moves:
-                    pygame.draw.rect(self.screen, (0, 255, 0), (move[1] * self.cell_size, move[0] * self.cell_size, self.cell_size, self.cell_size), 3)
+            if dirty:
+                # Draw the changed squares and their move outlines
+                self.draw_board(dirty)
+                for row, col in dirty:
+                    if (row, col) in outlined:
+                        pygame.draw.rect(self.screen, (0, 255, 0), (col * self.cell_size, row * self.cell_size, self.cell_size, self.cell_size), 3)
 
-            # Draw promotion popup if a pawn is being promoted
-            if promoting_pawn:
-                self.draw_promotion_popup(promotion_position, current_turn, white_pieces, black_pieces)
+                # Draw promotion popup if a pawn is being promoted
+                if promoting_pawn:
+                    self.draw_promotion_popup(promotion_position, current_turn)
 
-            # Update the display
-            pygame.display.update()
+                if overlay:
+                    self.draw_overlay(*overlay)
+
+                # Update the display
+                update_start = time.perf_counter()
+                if len(dirty) == len(frame):
+                    pygame.display.update()
+                else:
+                    pygame.display.update([pygame.Rect(col * self.cell_size, row * self.cell_size, self.cell_size, self.cell_size)
+                                           for row, col in dirty])
+                if profiler:
+                    profiler.add_time('display_update', time.perf_counter() - update_start)
+                last_frame = frame
+
+            if profiler:
+                profiler.end_frame()
+
+            if fps:
+                clock.tick(fps)
 
 
 
@@ -462,6 +461,33 @@ class ChessBoard:
 
 # Create a ChessBoard instance and run the game
 if __name__ == "__main__":
-    chess_board = ChessBoard(640, 640)
-
-    chess_board.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Play chess in a pygame window.')
+    parser.add_argument('--engine', choices=['white', 'black'], help='let the engine play this color')
+    parser.add_argument('--think-time', type=float, default=1.0, help='engine seconds per move')
+    parser.add_argument('--book', help='opening book made with book.py for the engine to play from')
+    parser.add_argument('--tablebases', help='directory of endgame tables made with tablebase.py')
+    parser.add_argument('--profile', metavar='FILE', help='run under cProfile and save its stats to FILE')
+    parser.add_argument('--stats', metavar='FILE', help='write frame timings to FILE (.json summary or .csv rows)')
+    parser.add_argument('--overlay', action='store_true', help='show frame timings on screen (F3 toggles)')
+    parser.add_argument('--load', metavar='FILE', help='continue a game saved with --save')
+    parser.add_argument('--save', metavar='FILE', help='save the game history to FILE when the window closes')
+    args = parser.parse_args()
+
+    engine = EngineWorker(time_limit=args.think_time, book_path=args.book,
+                          tablebase_dir=args.tablebases) if args.engine else None
+    profiler = Profiler(args.stats, overlay=args.overlay) if args.stats or args.overlay else None
+    history = GameHistory.load(args.load) if args.load else None
+    chess_board = ChessBoard(640, 640, engine=engine, engine_color=args.engine, profiler=profiler, history=history)
+
+    profile = cProfile.Profile() if args.profile else None
+    if profile:
+        profile.enable()
+    try:
+        chess_board.run()
+    finally:
+        if profile:
+            profile.disable()
+            profile.dump_stats(args.profile)
+            pstats.Stats(profile).sort_stats('cumulative').print_stats(25)
+        if args.save:
+            chess_board.history.save(args.save)
\ No newline at end of file
@@ -0,0 +1,177 @@
+"""Memory-mapped Polyglot opening book, and a builder that makes one from PGN.
+
+    python book.py build games.pgn.gz book.bin [--plies 20]
+    python book.py probe book.bin [--fen FEN]
+
+Entries are 16 bytes, big-endian (key, move, weight, learn), sorted by key,
+and looked up by binary search over the mapped file, so opening even a very
+large book reads nothing up front. Keys are Polyglot keys (polyglot.py), so
+books made by other Polyglot tools can be read and books made here can be
+used by them.
+"""
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+
+import bitboard
+from pgn import move_san, movetext_sans, open_text, parse_san, read_games
+from polyglot import polyglot_key
+from position import STARTING_FEN, Move, Position
+
+ENTRY = struct.Struct('>QHHI')  # key, move, weight, learn
+KEY = struct.Struct('>Q')
+# Polyglot promotion field: 1 knight, 2 bishop, 3 rook, 4 queen
+PROMOTION_CODES = {'knight': 1, 'bishop': 2, 'rook': 3, 'queen': 4}
+CODE_PROMOTIONS = {code: piece_type for piece_type, code in PROMOTION_CODES.items()}
+BOOK_PLIES = 20
+MAX_WEIGHT = 0xFFFF
+
+
+def encode_move(position, move):
+    """Pack a Move into Polyglot's 16-bit layout; castling is written as the king taking its own rook."""
+    (row, col), (new_row, new_col), promotion = move
+    if position.piece_at(row, col)[0] == 'king' and abs(new_col - col) == 2:
+        new_col = 7 if new_col > col else 0
+    return ((7 - new_row) << 3 | new_col | (7 - row) << 9 | col << 6
+            | PROMOTION_CODES.get(promotion, 0) << 12)
+
+
+def decode_move(position, raw):
+    """Unpack a Polyglot move into a Move that make_move() can play in this position."""
+    new_row, new_col = 7 - (raw >> 3 & 7), raw & 7
+    row, col = 7 - (raw >> 9 & 7), raw >> 6 & 7
+    piece = position.piece_at(row, col)
+    target = position.piece_at(new_row, new_col)
+    if piece and piece[0] == 'king' and target == ('rook', piece[1]):
+        new_col = 6 if new_col > col else 2
+    return Move((row, col), (new_row, new_col), CODE_PROMOTIONS.get(raw >> 12 & 7))
+
+
+class OpeningBook:
+    """Read-only view of a book file; entries are found by binary search on the memory map."""
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        # mmap cannot map an empty file, and an empty book simply has no moves
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.count = size // ENTRY.size
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def entries(self, key):
+        """Return (raw_move, weight) for every entry with this key."""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(self.data, middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        found = []
+        for index in range(low, self.count):
+            entry_key, raw, weight, _ = ENTRY.unpack_from(self.data, index * ENTRY.size)
+            if entry_key != key:
+                break
+            found.append((raw, weight))
+        return found
+
+    def moves(self, position, rules=bitboard):
+        """Return (Move, weight) for the book moves that are legal in the position."""
+        legal = rules.legal_moves(position)
+        found = []
+        for raw, weight in self.entries(polyglot_key(position)):
+            move = decode_move(position, raw)
+            if move in legal:
+                found.append((move, weight))
+        return found
+
+    def choose(self, position, rules=bitboard, rng=random):
+        """Pick a book move at random in proportion to its weight, or return None when out of book."""
+        candidates = [(move, weight) for move, weight in self.moves(position, rules) if weight]
+        if not candidates:
+            return None
+        moves, weights = zip(*candidates)
+        return rng.choices(moves, weights)[0]
+
+
+def build_book(games, out_path, plies=BOOK_PLIES, rules=bitboard):
+    """Write a book from (headers, movetext) games, counting the first plies moves of each.
+
+    Moves are weighted 2 for a win and 1 for a draw by the side that played
+    them, as Polyglot does; moves only seen in losses are left out. Returns
+    the number of entries written.
+    """
+    weights = {}
+    for headers, movetext in games:
+        sans, result = movetext_sans(movetext)
+        points = {'1-0': (2, 0), '0-1': (0, 2), '1/2-1/2': (1, 1)}.get(result)
+        if points is None:
+            continue
+        try:
+            position = Position.from_fen(headers.get('FEN', STARTING_FEN))
+            for san in sans[:plies]:
+                move = parse_san(position, san, rules)
+                entry = (polyglot_key(position), encode_move(position, move))
+                weights[entry] = weights.get(entry, 0) + points[position.turn != 'white']
+                position.make_move(move)
+        except (ValueError, IndexError):
+            continue  # Keep the moves up to an illegal one (or a bad FEN tag) and skip the rest of that game
+
+    entries = sorted((key, raw, weight) for (key, raw), weight in weights.items() if weight)
+    scale = max((weight for _, _, weight in entries), default=0) / MAX_WEIGHT
+    with open(out_path, 'wb') as f:
+        for key, raw, weight in entries:
+            if scale > 1:
+                weight = max(1, int(weight / scale))
+            f.write(ENTRY.pack(key, raw, weight, 0))
+    return len(entries)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = commands.add_parser('build', help='make a book from a PGN file')
+    build_parser.add_argument('pgn', help='PGN file, optionally gzipped')
+    build_parser.add_argument('book')
+    build_parser.add_argument('--plies', type=int, default=BOOK_PLIES, help='moves per game to take into the book')
+
+    probe_parser = commands.add_parser('probe', help='list the book moves of a position')
+    probe_parser.add_argument('book')
+    probe_parser.add_argument('--fen', default=STARTING_FEN)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        with open_text(args.pgn) as f:
+            count = build_book(read_games(f), args.book, args.plies)
+        print(f"{count} entries written to {args.book}")
+        return 0
+
+    position = Position.from_fen(args.fen)
+    with OpeningBook(args.book) as book:
+        moves = book.moves(position)
+        total = sum(weight for _, weight in moves)
+        for move, weight in sorted(moves, key=lambda item: -item[1]):
+            print(f"{move_san(position, move):<8} {weight:>6} {weight / total:.1%}")
+    return 0 if moves else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,333 @@
+"""Alpha-beta chess engine and a background worker that runs it off the UI thread."""
+import multiprocessing
+import queue
+import threading
+import time
+from collections import namedtuple
+
+import bitboard
+from book import OpeningBook
+from position import BLACK, CODE_PIECES, PIECE_CODES, WHITE
+from tablebase import INVALID, Tablebases, value_plies
+from zobrist import TranspositionTable
+
+MATE = 100000
+MAX_DEPTH = 64
+INFINITY = MATE + 1
+EXACT, LOWER, UPPER = 0, 1, 2  # Kinds of transposition table scores
+
+PIECE_VALUES = {'pawn': 100, 'knight': 320, 'bishop': 330, 'rook': 500, 'queen': 900, 'king': 0}
+
+# Piece-square tables from white's side, indexed row * 8 + col with row 0 the far rank
+PIECE_SQUARE_TABLES = {
+    'pawn': [
+        0, 0, 0, 0, 0, 0, 0, 0,
+        50, 50, 50, 50, 50, 50, 50, 50,
+        10, 10, 20, 30, 30, 20, 10, 10,
+        5, 5, 10, 25, 25, 10, 5, 5,
+        0, 0, 0, 20, 20, 0, 0, 0,
+        5, -5, -10, 0, 0, -10, -5, 5,
+        5, 10, 10, -20, -20, 10, 10, 5,
+        0, 0, 0, 0, 0, 0, 0, 0,
+    ],
+    'knight': [
+        -50, -40, -30, -30, -30, -30, -40, -50,
+        -40, -20, 0, 0, 0, 0, -20, -40,
+        -30, 0, 10, 15, 15, 10, 0, -30,
+        -30, 5, 15, 20, 20, 15, 5, -30,
+        -30, 0, 15, 20, 20, 15, 0, -30,
+        -30, 5, 10, 15, 15, 10, 5, -30,
+        -40, -20, 0, 5, 5, 0, -20, -40,
+        -50, -40, -30, -30, -30, -30, -40, -50,
+    ],
+    'bishop': [
+        -20, -10, -10, -10, -10, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 10, 10, 5, 0, -10,
+        -10, 5, 5, 10, 10, 5, 5, -10,
+        -10, 0, 10, 10, 10, 10, 0, -10,
+        -10, 10, 10, 10, 10, 10, 10, -10,
+        -10, 5, 0, 0, 0, 0, 5, -10,
+        -20, -10, -10, -10, -10, -10, -10, -20,
+    ],
+    'rook': [
+        0, 0, 0, 0, 0, 0, 0, 0,
+        5, 10, 10, 10, 10, 10, 10, 5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        0, 0, 0, 5, 5, 0, 0, 0,
+    ],
+    'queen': [
+        -20, -10, -10, -5, -5, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 5, 5, 5, 0, -10,
+        -5, 0, 5, 5, 5, 5, 0, -5,
+        0, 0, 5, 5, 5, 5, 0, -5,
+        -10, 5, 5, 5, 5, 5, 0, -10,
+        -10, 0, 5, 0, 0, 0, 0, -10,
+        -20, -10, -10, -5, -5, -10, -10, -20,
+    ],
+    'king': [
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -20, -30, -30, -40, -40, -30, -30, -20,
+        -10, -20, -20, -20, -20, -20, -20, -10,
+        20, 20, 0, 0, 0, 0, 20, 20,
+        20, 30, 10, 0, 0, 10, 30, 20,
+    ],
+}
+
+# Material plus placement for every piece code and square, positive for white
+SQUARE_SCORES = [None] * 16
+for _name, _table in PIECE_SQUARE_TABLES.items():
+    SQUARE_SCORES[PIECE_CODES[(_name, WHITE)]] = [PIECE_VALUES[_name] + _table[sq] for sq in range(64)]
+    SQUARE_SCORES[PIECE_CODES[(_name, BLACK)]] = [-PIECE_VALUES[_name] - _table[(7 - (sq >> 3)) * 8 + (sq & 7)]
+                                                  for sq in range(64)]
+# Material value of each piece code, 0 for an empty square
+CODE_VALUES = [PIECE_VALUES[piece[0]] if piece else 0 for piece in CODE_PIECES]
+
+# Outcome of a search; move is None when the side to move has no legal moves
+SearchResult = namedtuple('SearchResult', ['move', 'score', 'depth', 'nodes', 'seconds', 'nps', 'pv'])
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+def evaluate(position):
+    """Score the position in centipawns from the side to move's point of view."""
+    score = 0
+    for sq, code in enumerate(position.squares):
+        if code:
+            score += SQUARE_SCORES[code][sq]
+    return score if position.turn == WHITE else -score
+
+
+class Engine:
+    """Iterative-deepening negamax alpha-beta search with quiescence and a transposition table."""
+
+    def __init__(self, rules=bitboard, table=None, book=None, tablebases=None):
+        self.rules = rules
+        self.table = table if table is not None else TranspositionTable(1 << 18)
+        self.book = book  # Optional book.OpeningBook, played from before searching
+        self.tablebases = tablebases  # Optional tablebase.Tablebases, giving exact scores in small endgames
+        self.killers = [[None, None] for _ in range(MAX_DEPTH + 1)]
+        self.nodes = 0
+        self.deadline = None
+
+    def search(self, position, time_limit=1.0, max_depth=MAX_DEPTH):
+        """Search for up to time_limit seconds and return a SearchResult for the deepest finished iteration."""
+        if self.book is not None:
+            move = self.book.choose(position, self.rules)
+            if move is not None:
+                return SearchResult(move, 0, 0, 0, 0.0, 0.0, [move])
+        start = time.perf_counter()
+        self.deadline = start + time_limit
+        self.nodes = 0
+        self.killers = [[None, None] for _ in range(MAX_DEPTH + 1)]
+        self.table.new_generation()
+        # A timeout unwinds mid-move and leaves the searched position half played, so search a copy
+        root = position.copy()
+
+        moves = self.rules.legal_moves(root)
+        best_move, best_score, best_depth = (moves[0] if moves else None), 0, 0
+        if len(moves) > 1:
+            for depth in range(1, max_depth + 1):
+                try:
+                    score = self.negamax(root, depth, -INFINITY, INFINITY, 0)
+                except SearchTimeout:
+                    break
+                entry = self.table.probe(root.key)
+                if entry is not None and entry[1][2] is not None:
+                    best_move = entry[1][2]
+                best_score, best_depth = score, depth
+                if abs(score) >= MATE - MAX_DEPTH:
+                    break  # Forced mate found, deeper search cannot improve on it
+
+        seconds = time.perf_counter() - start
+        return SearchResult(best_move, best_score, best_depth, self.nodes, seconds,
+                            self.nodes / seconds if seconds else 0.0, self.principal_variation(position.copy(), best_depth))
+
+    def principal_variation(self, position, depth):
+        """Follow best moves through the transposition table."""
+        pv = []
+        for _ in range(depth):
+            entry = self.table.probe(position.key)
+            if entry is None or entry[1][2] is None or entry[1][2] not in self.rules.legal_moves(position):
+                break
+            pv.append(entry[1][2])
+            position.make_move(entry[1][2])
+        for _ in pv:
+            position.unmake_move()
+        return pv
+
+    def check_time(self):
+        if time.perf_counter() > self.deadline:
+            raise SearchTimeout
+
+    def order_moves(self, position, moves, tt_move, ply):
+        """Sort moves: table move, captures by most valuable victim and least valuable attacker, killers, the rest."""
+        squares = position.squares
+        killers = self.killers[ply] if ply <= MAX_DEPTH else (None, None)
+
+        def priority(move):
+            if move == tt_move:
+                return 1000000
+            (row, col), (new_row, new_col), promotion = move
+            victim = squares[new_row * 8 + new_col]
+            score = PIECE_VALUES[promotion] * 10 if promotion else 0
+            if victim:
+                score += 100000 + CODE_VALUES[victim] * 10 - CODE_VALUES[squares[row * 8 + col]] // 10
+            elif move in killers:
+                score += 50000
+            return score
+
+        moves.sort(key=priority, reverse=True)
+        return moves
+
+    def negamax(self, position, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes & 255 == 0:
+            self.check_time()
+        if ply and (position.halfmove_clock >= 100 or position.repetition_count() > 1):
+            return 0  # Draw by the fifty-move rule or a repeated position
+        if self.tablebases is not None and ply:
+            value = self.tablebases.probe(position)
+            if value is not None and value != INVALID:
+                plies = value_plies(value)
+                if plies is None:
+                    return 0
+                return MATE - ply - plies if plies > 0 else -MATE + ply - plies
+
+        key = position.key
+        tt_move = None
+        entry = self.table.probe(key)
+        if entry is not None:
+            entry_depth, (score, flag, tt_move) = entry
+            if ply and entry_depth >= depth:
+                # Mate scores are stored relative to the node, not the root
+                if score >= MATE - MAX_DEPTH:
+                    score -= ply
+                elif score <= -MATE + MAX_DEPTH:
+                    score += ply
+                if flag == EXACT or (flag == LOWER and score >= beta) or (flag == UPPER and score <= alpha):
+                    return score
+
+        in_check = self.rules.is_king_in_check(position, position.turn)
+        if in_check:
+            depth += 1  # Look one move further when in check
+        if depth <= 0:
+            return self.quiesce(position, alpha, beta, ply)
+
+        moves = self.rules.legal_moves(position)
+        if not moves:
+            return -MATE + ply if in_check else 0
+
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = None
+        for move in self.order_moves(position, moves, tt_move, ply):
+            position.make_move(move)
+            score = -self.negamax(position, depth - 1, -beta, -alpha, ply + 1)
+            position.unmake_move()
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if not position.squares[move.end[0] * 8 + move.end[1]] and ply <= MAX_DEPTH:
+                            killers = self.killers[ply]
+                            if killers[0] != move:
+                                killers[1], killers[0] = killers[0], move
+                        break
+
+        flag = UPPER if best_score <= original_alpha else LOWER if best_score >= beta else EXACT
+        stored = best_score
+        if stored >= MATE - MAX_DEPTH:
+            stored += ply
+        elif stored <= -MATE + MAX_DEPTH:
+            stored -= ply
+        self.table.store(key, (stored, flag, best_move), depth)
+        return best_score
+
+    def quiesce(self, position, alpha, beta, ply):
+        """Search captures and promotions only, until the position is quiet."""
+        self.nodes += 1
+        if self.nodes & 255 == 0:
+            self.check_time()
+        stand_pat = evaluate(position)
+        if stand_pat >= beta:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        squares = position.squares
+        captures = [move for move in self.rules.legal_moves(position)
+                    if move.promotion == 'queen' or squares[move.end[0] * 8 + move.end[1]]
+                    or (move.end == position.ep_square and CODE_PIECES[squares[move.start[0] * 8 + move.start[1]]][0] == 'pawn')]
+        for move in self.order_moves(position, captures, None, MAX_DEPTH + 1):
+            position.make_move(move)
+            score = -self.quiesce(position, -beta, -alpha, ply + 1)
+            position.unmake_move()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+
+def _serve(requests, results, table_size, book_path, tablebase_dir):
+    engine = Engine(table=TranspositionTable(table_size), book=OpeningBook(book_path) if book_path else None,
+                    tablebases=Tablebases(tablebase_dir) if tablebase_dir else None)
+    while True:
+        job = requests.get()
+        if job is None:
+            break
+        position, time_limit, max_depth = job
+        results.put(engine.search(position, time_limit, max_depth))
+
+
+class EngineWorker:
+    """Runs Engine.search in a background process (or thread) and hands results back through a queue.
+
+    Call start() with a position, then poll() from the UI loop until it
+    returns a SearchResult.
+    """
+
+    def __init__(self, time_limit=1.0, max_depth=MAX_DEPTH, table_size=1 << 18, use_thread=False, book_path=None,
+                 tablebase_dir=None):
+        self.time_limit = time_limit
+        self.max_depth = max_depth
+        args = (table_size, book_path, tablebase_dir)
+        if use_thread:
+            self.requests, self.results = queue.Queue(), queue.Queue()
+            self.worker = threading.Thread(target=_serve, args=(self.requests, self.results) + args, daemon=True)
+        else:
+            self.requests, self.results = multiprocessing.Queue(), multiprocessing.Queue()
+            self.worker = multiprocessing.Process(target=_serve, args=(self.requests, self.results) + args, daemon=True)
+        self.worker.start()
+        self.busy = False
+
+    def start(self, position):
+        """Begin searching a copy of the position."""
+        self.requests.put((position.copy(), self.time_limit, self.max_depth))
+        self.busy = True
+
+    def poll(self):
+        """Return the finished SearchResult, or None while the search is still running."""
+        try:
+            result = self.results.get_nowait()
+        except queue.Empty:
+            return None
+        self.busy = False
+        return result
+
+    def close(self):
+        self.requests.put(None)
+        self.worker.join(timeout=self.time_limit + 1)
@@ -0,0 +1,111 @@
+"""Move history of a game with periodic position snapshots, so any ply can be reached quickly.
+
+Moves are kept as 16-bit codes and every SNAPSHOT_INTERVAL plies the position
+is packed with Position.to_bytes(), so seeking replays fewer than
+SNAPSHOT_INTERVAL moves however long the game is. The same layout is written
+to disk, so a reloaded game can be seeked without replaying it first.
+"""
+import struct
+import sys
+from array import array
+
+from position import PROMOTION_PIECES, POSITION_BYTES, Move, Position
+
+SNAPSHOT_INTERVAL = 16
+MAGIC = b'CGH1'
+HEADER = struct.Struct('<4sBI')  # magic, snapshot interval, plies; then the snapshots and the move codes
+PROMOTION_INDEXES = {piece_type: index + 1 for index, piece_type in enumerate(PROMOTION_PIECES)}
+
+
+def encode_move(move):
+    """Pack a Move as start square | end square << 6 | promotion << 12."""
+    (row, col), (new_row, new_col), promotion = move
+    return row * 8 + col | (new_row * 8 + new_col) << 6 | PROMOTION_INDEXES.get(promotion, 0) << 12
+
+
+def decode_move(code):
+    start, end, promotion = code & 63, code >> 6 & 63, code >> 12
+    return Move((start >> 3, start & 7), (end >> 3, end & 7), PROMOTION_PIECES[promotion - 1] if promotion else None)
+
+
+class GameHistory:
+    """Moves played from a start position, with a packed snapshot every interval plies."""
+
+    def __init__(self, start=None, interval=SNAPSHOT_INTERVAL):
+        self.interval = interval
+        self.codes = array('H')
+        # snapshots[i] is the position after i * interval plies
+        self.snapshots = [(start or Position.initial()).to_bytes()]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def append(self, move, position):
+        """Record a move; position is the position after it."""
+        self.codes.append(encode_move(move))
+        if len(self.codes) % self.interval == 0:
+            self.snapshots.append(position.to_bytes())
+
+    def truncate(self, ply):
+        """Forget every move after the first ply moves."""
+        del self.codes[ply:]
+        del self.snapshots[ply // self.interval + 1:]
+
+    def moves(self, start=0, stop=None):
+        return [decode_move(code) for code in self.codes[start:stop]]
+
+    def position_at(self, ply, since_irreversible=False):
+        """Return the position after ply moves, replayed from the nearest snapshot.
+
+        With since_irreversible the replay starts early enough that the
+        position's undo history reaches back to the last capture or pawn move,
+        so repetition_count() and unmake_move() work as in the live game.
+        """
+        if not 0 <= ply <= len(self.codes):
+            raise IndexError(f"ply {ply} is outside the game's {len(self.codes)} plies")
+        base = ply // self.interval * self.interval
+        position = self.replay(base, ply)
+        if since_irreversible and position.halfmove_clock > ply - base:
+            # The last capture or pawn move came before that snapshot, so start from an earlier one
+            position = self.replay(max(0, ply - position.halfmove_clock) // self.interval * self.interval, ply)
+        return position
+
+    def replay(self, base, ply):
+        """Play the moves from snapshot ply base (a multiple of the interval) up to ply."""
+        position = Position.from_bytes(self.snapshots[base // self.interval])
+        for code in self.codes[base:ply]:
+            position.make_move(decode_move(code))
+        return position
+
+    def to_bytes(self):
+        codes = self.codes
+        if sys.byteorder == 'big':
+            codes = array('H', codes)
+            codes.byteswap()  # Files are little-endian
+        return HEADER.pack(MAGIC, self.interval, len(codes)) + b''.join(self.snapshots) + codes.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, interval, plies = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError('not a game history file')
+        history = cls.__new__(cls)
+        history.interval = interval
+        offset = HEADER.size
+        history.snapshots = [bytes(data[offset + index * POSITION_BYTES:offset + (index + 1) * POSITION_BYTES])
+                             for index in range(plies // interval + 1)]
+        offset += len(history.snapshots) * POSITION_BYTES
+        history.codes = array('H')
+        history.codes.frombytes(data[offset:offset + plies * history.codes.itemsize])
+        if sys.byteorder == 'big':
+            history.codes.byteswap()
+        return history
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
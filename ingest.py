@@ -0,0 +1,152 @@
+"""Replay PGN archives or FEN lists through the rules core to validate them and extract positions.
+
+    python ingest.py games.pgn.gz [--workers 8] [--positions out.fen]
+    python ingest.py positions.fen --format fen
+
+Files are read lazily (gzip is decompressed on the fly) and games are sent
+to worker processes in chunks, with only a few chunks in flight at once, so
+memory stays flat however large the archive is.
+"""
+import argparse
+import collections
+import multiprocessing
+import os
+import sys
+import time
+
+import bitboard
+import position
+from pgn import movetext_sans, open_text, parse_san, read_games
+from position import STARTING_FEN, Position, opponent
+
+RULES = {'position': position, 'bitboard': bitboard}
+CHUNK_SIZE = 64
+CHUNKS_IN_FLIGHT = 4  # Per worker
+
+
+def position_error(rules, position):
+    """Return why a position could not occur in a game, or None if it could."""
+    kings = collections.Counter(piece[1] for rank in position.board for piece in rank if piece and piece[0] == 'king')
+    if kings['white'] != 1 or kings['black'] != 1:
+        return 'each side needs exactly one king'
+    if any(piece and piece[0] == 'pawn' for piece in position.board[0] + position.board[7]):
+        return 'pawn on the first or last rank'
+    if rules.is_king_in_check(position, opponent(position.turn)):
+        return 'side not to move is in check'
+    return None
+
+
+def replay_game(rules, headers, movetext, extract=False):
+    """Replay one PGN game and return a result dict with its error (or None) and, optionally, every FEN."""
+    sans, result = movetext_sans(movetext)
+    fens = []
+    plies = 0
+    try:
+        game = Position.from_fen(headers.get('FEN', STARTING_FEN))
+        error = position_error(rules, game)
+        if error is None:
+            for san in sans:
+                if extract:
+                    fens.append(game.fen())
+                game.make_move(parse_san(game, san, rules))
+                plies += 1
+            if extract:
+                fens.append(game.fen())
+    except (ValueError, IndexError) as e:
+        error = str(e) or 'bad FEN'
+    return {'headers': headers, 'plies': plies, 'result': result, 'error': error, 'fens': fens}
+
+
+def replay_fen(rules, fen, extract=False):
+    """Check one FEN line the way replay_game checks a game."""
+    try:
+        error = position_error(rules, Position.from_fen(fen))
+    except (ValueError, IndexError) as e:
+        error = str(e) or 'bad FEN'
+    return {'headers': {'FEN': fen}, 'plies': 0, 'result': '*', 'error': error,
+            'fens': [fen] if extract and error is None else []}
+
+
+def replay_chunk(job):
+    """Replay a chunk of games or FENs; runs in a worker process."""
+    kind, items, rules_name, extract = job
+    rules = RULES[rules_name]
+    if kind == 'fen':
+        return [replay_fen(rules, fen, extract) for fen in items]
+    return [replay_game(rules, headers, movetext, extract) for headers, movetext in items]
+
+
+def read_items(path, kind):
+    """Yield games as (headers, movetext), or FEN strings, from a file without loading it whole."""
+    with open_text(path) as f:
+        if kind == 'pgn':
+            yield from read_games(f)
+        else:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    yield line
+
+
+def chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def replay_file(path, kind='pgn', rules_name='bitboard', workers=None, chunk_size=CHUNK_SIZE, extract=False):
+    """Yield replay results for every game in a file, in order, using a pool of worker processes."""
+    workers = workers or os.cpu_count()
+    with multiprocessing.Pool(workers) as pool:
+        pending = collections.deque()
+        for chunk in chunks(read_items(path, kind), chunk_size):
+            pending.append(pool.apply_async(replay_chunk, ((kind, chunk, rules_name, extract),)))
+            if len(pending) >= workers * CHUNKS_IN_FLIGHT:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help='PGN or FEN file, optionally gzipped')
+    parser.add_argument('--format', choices=['pgn', 'fen'], help='default: from the file name')
+    parser.add_argument('--rules', choices=RULES, default='bitboard')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--positions', help='write the FEN of every replayed position to this file')
+    parser.add_argument('--quiet', action='store_true', help='do not list invalid games')
+    args = parser.parse_args(argv)
+
+    kind = args.format or ('fen' if args.path.replace('.gz', '').endswith(('.fen', '.epd')) else 'pgn')
+    positions_file = open(args.positions, 'w') if args.positions else None
+    games = plies = invalid = 0
+    start = time.perf_counter()
+    try:
+        for result in replay_file(args.path, kind, args.rules, args.workers, args.chunk_size, bool(positions_file)):
+            games += 1
+            plies += result['plies']
+            if result['error']:
+                invalid += 1
+                if not args.quiet:
+                    where = result['headers'].get('FEN') if kind == 'fen' else f"game {games}"
+                    print(f"{where}: {result['error']}", file=sys.stderr)
+            if positions_file:
+                positions_file.writelines(fen + '\n' for fen in result['fens'])
+    finally:
+        if positions_file:
+            positions_file.close()
+
+    seconds = time.perf_counter() - start
+    print(f"{games} {'positions' if kind == 'fen' else 'games'}, {plies} plies, {invalid} invalid in {seconds:.1f}s: "
+          f"{games / seconds:.0f} games/s, {plies / seconds:.0f} plies/s", file=sys.stderr)
+    return 1 if invalid else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
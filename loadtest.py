@@ -0,0 +1,164 @@
+"""Load-test server.py with many idle and active games and report move latency percentiles.
+
+    python loadtest.py --idle 2000 --active 200 --moves 40
+    python loadtest.py --active 50 --engine-games 20 --think 0.05
+
+Active games play random legal moves for both sides as fast as replies come
+back; engine games play white against the server's engine. Idle games are
+opened and left alone for the whole run.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import sys
+import time
+
+import bitboard
+from position import Position, move_uci, parse_uci
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(values, percent):
+    """Return the nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(percent / 100 * len(values)) - 1))]
+
+
+def describe(name, seconds):
+    seconds = sorted(seconds)
+    if not seconds:
+        return f"{name}: none"
+    parts = ', '.join(f"p{percent} {percentile(seconds, percent) * 1000:.2f}" for percent in PERCENTILES)
+    return f"{name}: {len(seconds)} samples, {parts}, max {seconds[-1] * 1000:.2f} ms"
+
+
+class Client:
+    """One connection; matches replies to requests by id and queues pushed events per game."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.ids = itertools.count(1)
+        self.pending = {}
+        self.events = {}
+        self.listener = asyncio.create_task(self.listen())
+
+    @classmethod
+    async def connect(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port, limit=1 << 20)
+        return cls(reader, writer)
+
+    async def listen(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            if 'event' in message:
+                self.events.setdefault(message['game'], asyncio.Queue()).put_nowait(message)
+            else:
+                future = self.pending.pop(message['id'], None)
+                if future is not None:
+                    future.set_result(message)
+        for future in self.pending.values():
+            future.set_exception(ConnectionError('server closed the connection'))
+
+    async def request(self, op, **fields):
+        request_id = next(self.ids)
+        future = self.pending[request_id] = asyncio.get_running_loop().create_future()
+        self.writer.write(json.dumps({'id': request_id, 'op': op, **fields}).encode() + b'\n')
+        return await future
+
+    def event(self, game_id):
+        return self.events.setdefault(game_id, asyncio.Queue()).get()
+
+    async def close(self):
+        self.writer.close()
+        self.listener.cancel()
+
+
+async def active_game(client, moves, rng, stats, engine=False, think=None):
+    """Play one game through the server, recording how long each reply takes."""
+    reply = await client.request('new', engine='black' if engine else None, think=think)
+    if not reply['ok']:
+        raise RuntimeError(f"could not open a game: {reply['error']}")
+    game_id = reply['game']
+    board = Position.from_fen(reply['fen'])
+    for _ in range(moves):
+        legal = bitboard.legal_moves(board)
+        if not legal:
+            break
+        move = rng.choice(legal)
+        start = time.perf_counter()
+        reply = await client.request('move', game=game_id, move=move_uci(move))
+        stats['move'].append(time.perf_counter() - start)
+        if not reply['ok']:
+            stats['errors'] += 1
+            break
+        board.make_move(move)
+        if 'result' in reply:
+            break
+        if engine:
+            event = await client.event(game_id)
+            stats['engine'].append(time.perf_counter() - start)
+            if event['event'] != 'move':
+                break
+            board.make_move(parse_uci(event['move']))
+            if 'result' in event:
+                break
+    await client.request('close', game=game_id)
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    clients = [await Client.connect(args.host, args.port) for _ in range(args.connections)]
+    stats = {'move': [], 'engine': [], 'errors': 0}
+
+    start = time.perf_counter()
+    await asyncio.gather(*(clients[index % len(clients)].request('new') for index in range(args.idle)))
+    server_stats = await clients[0].request('stats')
+    print(f"{args.idle} idle games opened in {time.perf_counter() - start:.2f}s, "
+          f"{server_stats['games']} games on the server", file=sys.stderr)
+
+    start = time.perf_counter()
+    games = [active_game(clients[index % len(clients)], args.moves, random.Random(rng.random()), stats)
+             for index in range(args.active)]
+    games += [active_game(clients[index % len(clients)], args.moves, random.Random(rng.random()), stats,
+                          engine=True, think=args.think)
+              for index in range(args.engine_games)]
+    await asyncio.gather(*games)
+    seconds = time.perf_counter() - start
+
+    print(f"{args.active} active and {args.engine_games} engine games alongside {args.idle} idle ones "
+          f"over {args.connections} connections")
+    print(f"{len(stats['move'])} moves in {seconds:.2f}s: {len(stats['move']) / seconds:.0f} moves/s, "
+          f"{stats['errors']} errors")
+    print(describe('move reply', stats['move']))
+    if args.engine_games:
+        print(describe('engine reply', stats['engine']))
+    for client in clients:
+        await client.close()
+    return 1 if stats['errors'] else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--connections', type=int, default=20)
+    parser.add_argument('--idle', type=int, default=1000, help='games opened and never played')
+    parser.add_argument('--active', type=int, default=100, help='games playing random moves for both sides')
+    parser.add_argument('--engine-games', type=int, default=0, help='games playing white against the engine')
+    parser.add_argument('--moves', type=int, default=40, help='moves sent per active game')
+    parser.add_argument('--think', type=float, default=0.05, help='engine seconds per move in engine games')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
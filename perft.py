@@ -0,0 +1,187 @@
+"""Perft node counts and move-generation benchmarks.
+
+    python perft.py perft --depth 4 [--fen FEN] [--rules bitboard] [--hash 65536]
+    python perft.py suite [--max-nodes N] [--json]
+    python perft.py bench [--json] [--baseline bench.json --threshold 0.2]
+
+suite and bench exit with status 1 on a wrong node count or a speed regression.
+"""
+import argparse
+import json
+import sys
+import time
+
+import bitboard
+import position
+from position import STARTING_FEN, Position
+from zobrist import TranspositionTable
+
+RULES = {'position': position, 'bitboard': bitboard}
+
+# (name, FEN, node counts for depth 1, 2, ...)
+REFERENCE_POSITIONS = [
+    ('start', STARTING_FEN, [20, 400, 8902, 197281, 4865609]),
+    ('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1', [48, 2039, 97862, 4085603]),
+    ('endgame', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', [14, 191, 2812, 43238, 674624]),
+    ('castling', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1', [6, 264, 9467, 422333]),
+    ('promotion', 'n1n5/PPPk4/8/8/8/8/4Kppp/5N1N b - - 0 1', [24, 496, 9483, 182838]),
+    ('tricky', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8', [44, 1486, 62379, 2103487]),
+    ('middlegame', 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10', [46, 2079, 89890, 3894594]),
+]
+SUITE_MAX_NODES = 500000
+
+# Fixed positions and depth used by the benchmark
+BENCH_POSITIONS = [fen for _, fen, _ in REFERENCE_POSITIONS]
+BENCH_DEPTH = 2
+BENCH_REPEAT = 5
+
+
+def perft(rules, position, depth, table=None):
+    """Count the leaf nodes of the legal move tree to the given depth.
+
+    With a TranspositionTable, subtrees reached again by another move order
+    are counted once.
+    """
+    if table is not None and depth >= 1:
+        entry = table.probe(position.key)
+        if entry is not None and entry[0] == depth:
+            return entry[1]
+    if depth == 0:
+        return 1
+    moves = rules.legal_moves(position)
+    if depth == 1:
+        nodes = len(moves)
+    else:
+        nodes = 0
+        for move in moves:
+            position.make_move(move)
+            nodes += perft(rules, position, depth - 1, table)
+            position.unmake_move()
+    if table is not None:
+        table.store(position.key, nodes, depth)
+    return nodes
+
+
+def timed_perft(rules, fen, depth, table=None):
+    """Run perft from a FEN and return (nodes, seconds)."""
+    start = time.perf_counter()
+    nodes = perft(rules, Position.from_fen(fen), depth, table)
+    return nodes, time.perf_counter() - start
+
+
+def run_suite(rules, max_nodes=SUITE_MAX_NODES):
+    """Check every reference count, skipping depths larger than max_nodes."""
+    results = []
+    for name, fen, counts in REFERENCE_POSITIONS:
+        for depth, expected in enumerate(counts, 1):
+            if max_nodes is not None and expected > max_nodes:
+                break
+            nodes, seconds = timed_perft(rules, fen, depth)
+            results.append({
+                'name': name, 'depth': depth, 'expected': expected, 'nodes': nodes,
+                'ok': nodes == expected, 'seconds': seconds, 'nps': nodes / seconds if seconds else 0.0,
+            })
+    return results
+
+
+def run_bench(rules_names, depth=BENCH_DEPTH, repeat=BENCH_REPEAT):
+    """Time perft over BENCH_POSITIONS for each rules backend, keeping the fastest of repeat runs."""
+    results = {}
+    for name in rules_names:
+        total_seconds = None
+        for _ in range(repeat):
+            total_nodes = 0
+            seconds = 0.0
+            for fen in BENCH_POSITIONS:
+                nodes, elapsed = timed_perft(RULES[name], fen, depth)
+                total_nodes += nodes
+                seconds += elapsed
+            total_seconds = seconds if total_seconds is None else min(total_seconds, seconds)
+        results[name] = {'nodes': total_nodes, 'seconds': total_seconds, 'nps': total_nodes / total_seconds}
+    if 'position' in results:
+        for result in results.values():
+            result['speedup'] = result['nps'] / results['position']['nps']
+    return results
+
+
+def find_regressions(results, baseline, threshold):
+    """Return messages for every backend that is more than threshold slower than the baseline."""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous and result['nps'] < previous['nps'] * (1 - threshold):
+            regressions.append(f"{name}: {result['nps']:.0f} nps is below baseline {previous['nps']:.0f} nps")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    perft_parser = commands.add_parser('perft', help='count nodes from one position')
+    perft_parser.add_argument('--fen', default=STARTING_FEN)
+    perft_parser.add_argument('--depth', type=int, default=3)
+    perft_parser.add_argument('--rules', choices=RULES, default='bitboard')
+    perft_parser.add_argument('--hash', type=int, default=0, help='transposition table entries, 0 for none')
+    perft_parser.add_argument('--json', action='store_true')
+
+    suite_parser = commands.add_parser('suite', help='check the reference node counts')
+    suite_parser.add_argument('--rules', choices=RULES, default='bitboard')
+    suite_parser.add_argument('--max-nodes', type=int, default=SUITE_MAX_NODES,
+                              help='skip depths with more nodes than this')
+    suite_parser.add_argument('--json', action='store_true')
+
+    bench_parser = commands.add_parser('bench', help='compare move generation speed of the rules backends')
+    bench_parser.add_argument('--rules', choices=RULES, nargs='+', default=list(RULES))
+    bench_parser.add_argument('--depth', type=int, default=BENCH_DEPTH)
+    bench_parser.add_argument('--repeat', type=int, default=BENCH_REPEAT)
+    bench_parser.add_argument('--baseline', help='JSON from an earlier bench --json run')
+    bench_parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown against the baseline')
+    bench_parser.add_argument('--json', action='store_true')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'perft':
+        table = TranspositionTable(args.hash) if args.hash else None
+        nodes, seconds = timed_perft(RULES[args.rules], args.fen, args.depth, table)
+        result = {'fen': args.fen, 'depth': args.depth, 'nodes': nodes, 'seconds': seconds,
+                  'nps': nodes / seconds if seconds else 0.0}
+        if table is not None:
+            result['hash'] = table.stats()
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(f"depth {args.depth}: {nodes} nodes in {seconds:.3f}s ({result['nps']:.0f} nps)")
+            if table is not None:
+                print(f"hash: {table.hits} hits, {table.misses} misses ({result['hash']['hit_rate']:.0%})")
+        return 0
+
+    if args.command == 'suite':
+        results = run_suite(RULES[args.rules], args.max_nodes)
+        if args.json:
+            print(json.dumps(results))
+        else:
+            for result in results:
+                status = 'ok' if result['ok'] else f"FAIL (expected {result['expected']})"
+                print(f"{result['name']:<12} depth {result['depth']}: {result['nodes']:>9} {status}"
+                      f"  {result['nps']:.0f} nps")
+        return 0 if all(result['ok'] for result in results) else 1
+
+    results = run_bench(args.rules, args.depth, args.repeat)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.threshold)
+    if args.json:
+        print(json.dumps(results))
+    else:
+        for name, result in results.items():
+            speedup = f"  x{result['speedup']:.1f}" if 'speedup' in result else ''
+            print(f"{name:<10} {result['nodes']:>8} nodes {result['seconds']:.3f}s {result['nps']:.0f} nps{speedup}")
+    for message in regressions:
+        print(message, file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
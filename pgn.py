@@ -0,0 +1,147 @@
+"""Standard Algebraic Notation, PGN text, and lazy PGN reading for games played on the rules core."""
+import gzip
+import re
+
+import bitboard
+from position import parse_square, square_name
+
+SAN_LETTERS = {'knight': 'N', 'bishop': 'B', 'rook': 'R', 'queen': 'Q', 'king': 'K'}
+SAN_PIECES = {letter: piece_type for piece_type, letter in SAN_LETTERS.items()}
+LINE_WIDTH = 80
+
+SAN_PATTERN = re.compile(r'([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?')
+TAG_PATTERN = re.compile(r'\[(\w+)\s+"(.*)"\]')
+COMMENT_PATTERN = re.compile(r'\{[^}]*\}|;[^\n]*')
+TOKEN_PATTERN = re.compile(r'[()]|\$\d+|1-0|0-1|1/2-1/2|\*|\d+\.+|[^\s()]+')
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+
+
+def move_san(position, move, rules=bitboard):
+    """Return the SAN of a legal move, such as 'Nbd7', 'exd6', 'e8=Q+' or 'O-O#'."""
+    (row, col), (new_row, new_col), promotion = move
+    board = list(position.board)
+    piece_type = board[row][col][0]
+
+    if piece_type == 'king' and abs(new_col - col) == 2:
+        san = 'O-O' if new_col > col else 'O-O-O'
+    else:
+        capture = board[new_row][new_col] is not None or (
+            piece_type == 'pawn' and col != new_col)
+        if piece_type == 'pawn':
+            san = square_name((row, col))[0] + 'x' if capture else ''
+        else:
+            san = SAN_LETTERS[piece_type]
+            # Other pieces of the same type that can reach the same square
+            rivals = [other.start for other in rules.legal_moves(position)
+                      if other.end == move.end and other.start != move.start
+                      and board[other.start[0]][other.start[1]][0] == piece_type]
+            if rivals:
+                if all(start[1] != col for start in rivals):
+                    san += square_name((row, col))[0]
+                elif all(start[0] != row for start in rivals):
+                    san += square_name((row, col))[1]
+                else:
+                    san += square_name((row, col))
+            if capture:
+                san += 'x'
+        san += square_name((new_row, new_col))
+        if promotion:
+            san += '=' + SAN_LETTERS[promotion]
+
+    position.make_move(move)
+    if rules.is_king_in_check(position, position.turn):
+        san += '#' if not rules.legal_moves(position) else '+'
+    position.unmake_move()
+    return san
+
+
+def format_game(headers, sans, result):
+    """Return PGN text for one game from a dict of tag pairs and its moves in SAN."""
+    lines = [f'[{name} "{value}"]' for name, value in headers.items()]
+    lines.append('')
+    tokens = []
+    for ply, san in enumerate(sans):
+        if ply % 2 == 0:
+            tokens.append(f'{ply // 2 + 1}.')
+        tokens.append(san)
+    tokens.append(result)
+
+    line = ''
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > LINE_WIDTH:
+            lines.append(line)
+            line = token
+        else:
+            line = f'{line} {token}' if line else token
+    lines.append(line)
+    return '\n'.join(lines) + '\n\n'
+
+
+def parse_san(position, san, rules=bitboard):
+    """Return the legal Move written as san in this position; raise ValueError if there is none or several."""
+    text = san.rstrip('+#!?')
+    board = list(position.board)
+    moves = rules.legal_moves(position)
+    if text in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        step = 2 if len(text) == 3 else -2
+        candidates = [move for move in moves if board[move.start[0]][move.start[1]][0] == 'king'
+                      and move.end[1] - move.start[1] == step]
+    else:
+        match = SAN_PATTERN.fullmatch(text)
+        if not match:
+            raise ValueError(f"Bad SAN {san!r}")
+        letter, file, rank, target, promotion = match.groups()
+        piece_type = SAN_PIECES[letter] if letter else 'pawn'
+        end = parse_square(target)
+        promotion = SAN_PIECES[promotion] if promotion else None
+        candidates = [move for move in moves if move.end == end and move.promotion == promotion
+                      and board[move.start[0]][move.start[1]][0] == piece_type
+                      and (file is None or move.start[1] == 'abcdefgh'.index(file))
+                      and (rank is None or move.start[0] == 8 - int(rank))]
+    if len(candidates) != 1:
+        raise ValueError(f"{'Ambiguous' if candidates else 'Illegal'} move {san!r} in {position.fen()}")
+    return candidates[0]
+
+
+def open_text(path):
+    """Open a text file for reading, decompressing it on the fly if it ends in .gz."""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, encoding='utf-8', errors='replace')
+
+
+def read_games(lines):
+    """Yield (headers, movetext) for each game in an iterable of PGN lines, one game at a time."""
+    headers = {}
+    movetext = []
+    for line in lines:
+        line = line.strip()
+        match = TAG_PATTERN.fullmatch(line)
+        if match:
+            if movetext:
+                yield headers, '\n'.join(movetext)
+                headers, movetext = {}, []
+            headers[match.group(1)] = match.group(2)
+        elif line and not line.startswith('%'):
+            movetext.append(line)
+    if headers or movetext:
+        yield headers, '\n'.join(movetext)
+
+
+def movetext_sans(movetext):
+    """Return the main-line SAN moves and the result token of a movetext, skipping comments and variations."""
+    sans = []
+    result = '*'
+    depth = 0  # Nesting of ( ) variations
+    for token in TOKEN_PATTERN.findall(COMMENT_PATTERN.sub(' ', movetext)):
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        elif depth or token[0] == '$' or token[0].isdigit() and token.rstrip('.').isdigit():
+            continue
+        elif token in RESULTS:
+            result = token
+        else:
+            sans.append(token)
+    return sans, result
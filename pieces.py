@@ -4,6 +4,8 @@ class PieceManager:
     def __init__(self, cell_size):
         self.cell_size = cell_size
         self.piece_images = self.load_piece_images()
+        # Scaled copies of the images, keyed by (color, piece, size in pixels)
+        self.sprite_cache = {}
         # Define separate scaling factors for white and black pieces
         self.scale_factors = {
             'white': {
@@ -39,18 +41,31 @@ class PieceManager:
                     print(f"Error loading image for {color} {piece}: {e}")
         return piece_images
 
-    def draw_piece(self, screen, piece, color, col, row):
-        """Draw a specific piece of a given color at a given cell position."""
-        key = f"{color}_{piece}"
-        if key in self.piece_images:
-            piece_image = self.piece_images[key]
-            scale_factor = self.scale_factors.get(color, {}).get(piece, 1)  # Get color-specific factor
-            scaled_width = int(self.cell_size * scale_factor)
-            scaled_height = int(self.cell_size * scale_factor)
+    def set_cell_size(self, cell_size):
+        """Change the board cell size, dropping sprites scaled for the old one."""
+        if cell_size != self.cell_size:
+            self.cell_size = cell_size
+            self.sprite_cache.clear()
 
-            # Scale the image to the desired size
-            scaled_image = pygame.transform.scale(piece_image, (scaled_width, scaled_height))
+    def get_sprite(self, color, piece, size):
+        """Return the piece image scaled to size x size pixels, or None if it failed to load."""
+        key = (color, piece, size)
+        sprite = self.sprite_cache.get(key)
+        if sprite is None:
+            piece_image = self.piece_images.get(f"{color}_{piece}")
+            if piece_image is None:
+                return None
+            sprite = pygame.transform.smoothscale(piece_image, (size, size)).convert_alpha()
+            self.sprite_cache[key] = sprite
+        return sprite
 
+    def draw_piece(self, screen, piece, color, col, row):
+        """Draw a specific piece of a given color at a given cell position."""
+        scale_factor = self.scale_factors.get(color, {}).get(piece, 1)  # Get color-specific factor
+        scaled_width = int(self.cell_size * scale_factor)
+        scaled_height = scaled_width
+        scaled_image = self.get_sprite(color, piece, scaled_width)
+        if scaled_image is not None:
             # Calculate the position to center the image in the cell
             position = (col * self.cell_size + (self.cell_size - scaled_width) // 2,
                         row * self.cell_size + (self.cell_size - scaled_height) // 2)
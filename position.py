@@ -0,0 +1,592 @@
+"""Headless chess rules: board state and move generation with no pygame dependency."""
+import struct
+from collections import namedtuple
+
+from zobrist import BLACK_TO_MOVE_KEY, CASTLING_KEYS, EP_KEYS, PIECE_KEYS
+
+WHITE = 'white'
+BLACK = 'black'
+
+# Same order as the promotion popup in board.py
+PROMOTION_PIECES = ('queen', 'rook', 'knight', 'bishop')
+
+KNIGHT_STEPS = ((2, 1), (2, -1), (-2, 1), (-2, -1), (1, 2), (1, -2), (-1, 2), (-1, -2))
+KING_STEPS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1))
+ROOK_DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+BISHOP_DIRECTIONS = ((1, 1), (-1, -1), (1, -1), (-1, 1))
+SLIDING_DIRECTIONS = {
+    'rook': ROOK_DIRECTIONS,
+    'bishop': BISHOP_DIRECTIONS,
+    'queen': ROOK_DIRECTIONS + BISHOP_DIRECTIONS,
+}
+
+# Castling rights are a bit mask, written KQkq in FEN
+WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE = 1, 2, 4, 8
+CASTLING_LETTERS = ((WHITE_KINGSIDE, 'K'), (WHITE_QUEENSIDE, 'Q'), (BLACK_KINGSIDE, 'k'), (BLACK_QUEENSIDE, 'q'))
+# (kingside, queenside) rights and the home row of each side
+CASTLING_RIGHTS = {WHITE: (WHITE_KINGSIDE, WHITE_QUEENSIDE), BLACK: (BLACK_KINGSIDE, BLACK_QUEENSIDE)}
+HOME_ROW = {WHITE: 7, BLACK: 0}
+# Rights lost when a piece moves from or to one of these squares
+CASTLING_SQUARES = {
+    (7, 4): WHITE_KINGSIDE | WHITE_QUEENSIDE, (7, 7): WHITE_KINGSIDE, (7, 0): WHITE_QUEENSIDE,
+    (0, 4): BLACK_KINGSIDE | BLACK_QUEENSIDE, (0, 7): BLACK_KINGSIDE, (0, 0): BLACK_QUEENSIDE,
+}
+
+FEN_LETTERS = {'pawn': 'p', 'knight': 'n', 'bishop': 'b', 'rook': 'r', 'queen': 'q', 'king': 'k'}
+FEN_PIECES = {letter: piece_type for piece_type, letter in FEN_LETTERS.items()}
+STARTING_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+# Squares hold small-integer piece codes: the piece type's index in PIECE_TYPES
+# plus one, plus BLACK_BIT for black pieces, and 0 for an empty square
+PIECE_TYPES = ('pawn', 'knight', 'bishop', 'rook', 'queen', 'king')
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(1, 7)
+BLACK_BIT = 8
+PIECE_CODES = {(piece_type, color): index + 1 + (BLACK_BIT if color == BLACK else 0)
+               for index, piece_type in enumerate(PIECE_TYPES) for color in (WHITE, BLACK)}
+CODE_PIECES = [None] * 16  # Code -> (piece_type, color)
+CODE_COLORS = [None] * 16
+CODE_LETTERS = [''] * 16  # Code -> FEN letter
+CODE_KEYS = [None] * 16  # Code -> Zobrist key per square
+for (_piece_type, _color), _code in PIECE_CODES.items():
+    CODE_PIECES[_code] = (_piece_type, _color)
+    CODE_COLORS[_code] = _color
+    CODE_LETTERS[_code] = FEN_LETTERS[_piece_type].upper() if _color == WHITE else FEN_LETTERS[_piece_type]
+    CODE_KEYS[_code] = PIECE_KEYS[(_piece_type, _color)]
+LETTER_CODES = {letter: code for code, letter in enumerate(CODE_LETTERS) if letter}
+
+# Layout of Position.to_bytes(): square codes, castling rights << 1 | black to move,
+# en passant square index (255 for none), halfmove clock and fullmove number
+POSITION_STRUCT = struct.Struct('<64sBBHH')
+POSITION_BYTES = POSITION_STRUCT.size
+
+# A move from one (row, col) square to another; promotion is a piece type or None.
+# Castling is the king moving two squares, en passant a pawn moving to ep_square.
+Move = namedtuple('Move', ['start', 'end', 'promotion'])
+
+
+def opponent(color):
+    """Return the other side's color."""
+    return BLACK if color == WHITE else WHITE
+
+
+def square_name(square):
+    """Return the algebraic name of a (row, col) square, e.g. (7, 4) -> 'e1'."""
+    row, col = square
+    return 'abcdefgh'[col] + str(8 - row)
+
+
+def parse_square(name):
+    """Return the (row, col) of an algebraic square name."""
+    if len(name) != 2 or name[0] not in 'abcdefgh' or name[1] not in '12345678':
+        raise ValueError(f"Bad square {name!r}")
+    return (8 - int(name[1]), 'abcdefgh'.index(name[0]))
+
+
+def move_uci(move):
+    """Return a move in long algebraic (UCI) form, e.g. 'e2e4' or 'e7e8q'."""
+    promotion = FEN_LETTERS[move.promotion] if move.promotion else ''
+    return square_name(move.start) + square_name(move.end) + promotion
+
+
+def parse_uci(text):
+    """Return the Move written in UCI form; legality is not checked."""
+    if len(text) not in (4, 5) or (len(text) == 5 and text[4] not in 'qrbn'):
+        raise ValueError(f"Bad move {text!r}")
+    return Move(parse_square(text[:2]), parse_square(text[2:4]), FEN_PIECES[text[4]] if len(text) == 5 else None)
+
+
+class BoardView:
+    """Read-only 8x8 view of a Position's squares as None or (piece_type, color) tuples.
+
+    board[row][col] works as it did when Position stored nested lists, so
+    rendering code can keep using it. Each row is a fresh list, so writes to
+    it are not seen by the position; change squares with Position.put().
+    """
+    __slots__ = ('squares',)
+
+    def __init__(self, squares):
+        self.squares = squares
+
+    def __len__(self):
+        return 8
+
+    def __getitem__(self, row):
+        if not 0 <= row < 8:
+            raise IndexError(row)
+        return [CODE_PIECES[code] for code in self.squares[row * 8:row * 8 + 8]]
+
+    def __iter__(self):
+        for row in range(8):
+            yield self[row]
+
+
+class Position:
+    __slots__ = ('squares', 'turn', 'kings', 'castling', 'ep_square', 'halfmove_clock', 'fullmove_number',
+                 'history', 'key', 'version', 'bitboards')
+
+    def __init__(self, squares=None, turn=WHITE, kings=None):
+        # One piece code per square, index row * 8 + col; row 0 is black's back rank.
+        # Change squares through put() or make_move() so the king squares and
+        # cached bitboards stay in sync.
+        self.squares = bytearray(squares) if squares is not None else bytearray(64)
+        self.turn = turn
+        # (row, col) of each side's king, kept up to date by put() and make_move()
+        self.kings = dict(kings) if kings is not None else self.scan_kings()
+        self.castling = 0  # Bit mask of the castling rights still available
+        self.ep_square = None  # Square a pawn skipped over on the last move
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
+        # Undo records pushed by make_move() and popped by unmake_move()
+        self.history = []
+        # Zobrist key, updated incrementally by put(), make_move() and unmake_move()
+        self.key = self.compute_key()
+        # Bumped on every change so callers can tell when cached results go stale
+        self.version = 0
+        # Cache for bitboard.py, dropped whenever the board changes
+        self.bitboards = None
+
+    @property
+    def board(self):
+        """The squares as an 8x8 grid of None or (piece_type, color), for code that reads the board."""
+        return BoardView(self.squares)
+
+    def __hash__(self):
+        return self.key
+
+    def __eq__(self, other):
+        if not isinstance(other, Position):
+            return NotImplemented
+        return (self.key == other.key and self.squares == other.squares and self.turn == other.turn
+                and self.castling == other.castling and self.ep_square == other.ep_square)
+
+    @classmethod
+    def initial(cls):
+        """Return a position with the pieces in their starting squares."""
+        position = cls()
+        position.setup_pieces()
+        return position
+
+    @classmethod
+    def from_fen(cls, fen):
+        """Build a position from a FEN string."""
+        fields = fen.split()
+        if not fields:
+            raise ValueError("Empty FEN")
+        ranks = fields[0].split('/')
+        if len(ranks) != 8:
+            raise ValueError(f"FEN board needs 8 ranks: {fen!r}")
+        squares = bytearray(64)
+        for row, rank in enumerate(ranks):
+            col = 0
+            for char in rank:
+                if char.isdigit():
+                    col += int(char)
+                elif char in LETTER_CODES and col < 8:
+                    squares[row * 8 + col] = LETTER_CODES[char]
+                    col += 1
+                else:
+                    raise ValueError(f"Bad FEN rank {rank!r}")
+            if col != 8:
+                raise ValueError(f"Bad FEN rank {rank!r}")
+        fields += ['w', '-', '-', '0', '1'][len(fields) - 1:]
+        position = cls(squares, BLACK if fields[1] == 'b' else WHITE)
+        for right, letter in CASTLING_LETTERS:
+            if letter in fields[2]:
+                position.castling |= right
+        position.ep_square = None if fields[3] == '-' else parse_square(fields[3])
+        position.halfmove_clock = int(fields[4])
+        position.fullmove_number = int(fields[5])
+        position.key = position.compute_key()
+        return position
+
+    def fen(self):
+        """Return the position as a FEN string."""
+        ranks = []
+        for row in range(8):
+            text = ''
+            empty = 0
+            for code in self.squares[row * 8:row * 8 + 8]:
+                if not code:
+                    empty += 1
+                    continue
+                if empty:
+                    text += str(empty)
+                    empty = 0
+                text += CODE_LETTERS[code]
+            ranks.append(text + (str(empty) if empty else ''))
+        castling = ''.join(letter for right, letter in CASTLING_LETTERS if self.castling & right) or '-'
+        ep_square = square_name(self.ep_square) if self.ep_square else '-'
+        return f"{'/'.join(ranks)} {self.turn[0]} {castling} {ep_square} {self.halfmove_clock} {self.fullmove_number}"
+
+    def to_bytes(self):
+        """Pack the squares, side to move, rights and clocks into POSITION_BYTES bytes; history is not kept."""
+        ep_square = 255 if self.ep_square is None else self.ep_square[0] * 8 + self.ep_square[1]
+        flags = self.castling << 1 | (self.turn == BLACK)
+        return POSITION_STRUCT.pack(bytes(self.squares), flags, ep_square,
+                                    min(self.halfmove_clock, 0xFFFF), min(self.fullmove_number, 0xFFFF))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Rebuild a position packed by to_bytes()."""
+        squares, flags, ep_square, halfmove_clock, fullmove_number = POSITION_STRUCT.unpack(data)
+        position = cls(squares, BLACK if flags & 1 else WHITE)
+        position.castling = flags >> 1
+        position.ep_square = None if ep_square == 255 else (ep_square >> 3, ep_square & 7)
+        position.halfmove_clock = halfmove_clock
+        position.fullmove_number = fullmove_number
+        position.key = position.compute_key()
+        return position
+
+    def setup_pieces(self):
+        """Set up initial piece positions on the board."""
+        back_rank = ['rook', 'knight', 'bishop', 'queen', 'king', 'bishop', 'knight', 'rook']
+        self.squares = bytearray(64)
+        for col, piece_type in enumerate(back_rank):
+            self.squares[col] = PIECE_CODES[(piece_type, BLACK)]
+            self.squares[8 + col] = PIECE_CODES[('pawn', BLACK)]
+            self.squares[48 + col] = PIECE_CODES[('pawn', WHITE)]
+            self.squares[56 + col] = PIECE_CODES[(piece_type, WHITE)]
+        self.turn = WHITE
+        self.kings = {WHITE: (7, 4), BLACK: (0, 4)}
+        self.castling = WHITE_KINGSIDE | WHITE_QUEENSIDE | BLACK_KINGSIDE | BLACK_QUEENSIDE
+        self.ep_square = None
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
+        self.history = []
+        self.key = self.compute_key()
+        self.version += 1
+        self.bitboards = None
+
+    def copy(self):
+        """Return an independent copy of this position."""
+        position = Position.__new__(Position)  # Every slot is set below, so skip __init__'s scans
+        position.squares = self.squares[:]
+        position.turn = self.turn
+        position.kings = self.kings.copy()
+        position.castling = self.castling
+        position.ep_square = self.ep_square
+        position.halfmove_clock = self.halfmove_clock
+        position.fullmove_number = self.fullmove_number
+        position.history = self.history[:]
+        position.key = self.key
+        position.version = 0
+        position.bitboards = None
+        return position
+
+    def piece_at(self, row, col):
+        return CODE_PIECES[self.squares[row * 8 + col]]
+
+    def put(self, row, col, piece):
+        """Place a piece (or None) on a square."""
+        sq = row * 8 + col
+        old = self.squares[sq]
+        if old:
+            self.key ^= CODE_KEYS[old][sq]
+            if old & 7 == KING and self.kings[CODE_COLORS[old]] == (row, col):
+                self.kings[CODE_COLORS[old]] = None
+        code = PIECE_CODES[piece] if piece else 0
+        self.squares[sq] = code
+        if code:
+            self.key ^= CODE_KEYS[code][sq]
+            if code & 7 == KING:
+                self.kings[piece[1]] = (row, col)
+        self.version += 1
+        self.bitboards = None
+
+    def compute_key(self):
+        """Compute the Zobrist key from scratch."""
+        key = CASTLING_KEYS[self.castling] ^ self.ep_key()
+        for sq, code in enumerate(self.squares):
+            if code:
+                key ^= CODE_KEYS[code][sq]
+        if self.turn == BLACK:
+            key ^= BLACK_TO_MOVE_KEY
+        return key
+
+    def ep_key(self):
+        """Return the en passant part of the key, which only counts when a capture is possible."""
+        if self.ep_square is None:
+            return 0
+        row, col = self.ep_square
+        pawn_row = row + 1 if self.turn == WHITE else row - 1
+        pawn = PAWN | (BLACK_BIT if self.turn == BLACK else 0)
+        if (col > 0 and self.squares[pawn_row * 8 + col - 1] == pawn) or (
+                col < 7 and self.squares[pawn_row * 8 + col + 1] == pawn):
+            return EP_KEYS[col]
+        return 0
+
+    def repetition_count(self):
+        """Return how often the current position has occurred, looking back only to the last capture or pawn move."""
+        count = 1
+        for back in range(2, min(self.halfmove_clock, len(self.history)) + 1, 2):
+            if self.history[-back][-1] == self.key:
+                count += 1
+        return count
+
+    def piece_moves(self, row, col, piece=None):
+        """Return the squares a piece can reach, ignoring whether its own king is left in check."""
+        squares = self.squares
+        code = PIECE_CODES[piece] if piece else squares[row * 8 + col]
+        own = code & BLACK_BIT
+        kind = code & 7
+        moves = []
+
+        if kind == PAWN:
+            direction = 1 if own else -1  # White moves up, black moves down
+            start_row = 1 if own else 6
+            new_row = row + direction
+            if not 0 <= new_row < 8:
+                return moves
+
+            # Forward one, or two from the starting row
+            if not squares[new_row * 8 + col]:
+                moves.append((new_row, col))
+                if row == start_row and not squares[(new_row + direction) * 8 + col]:
+                    moves.append((new_row + direction, col))
+
+            # Capture diagonally, including en passant onto the square a pawn just skipped
+            ep_row = 5 if own else 2
+            for dx in (-1, 1):
+                if 0 <= col + dx < 8:
+                    target = squares[new_row * 8 + col + dx]
+                    if target and target & BLACK_BIT != own:
+                        moves.append((new_row, col + dx))
+                    elif new_row == ep_row and (new_row, col + dx) == self.ep_square:
+                        moves.append((new_row, col + dx))
+
+        elif kind == KNIGHT or kind == KING:
+            steps = KNIGHT_STEPS if kind == KNIGHT else KING_STEPS
+            for dx, dy in steps:
+                new_row, new_col = row + dx, col + dy
+                if 0 <= new_row < 8 and 0 <= new_col < 8:
+                    target = squares[new_row * 8 + new_col]
+                    if not target or target & BLACK_BIT != own:
+                        moves.append((new_row, new_col))
+            if kind == KING and self.castling:
+                moves.extend(self.castling_moves(row, col, BLACK if own else WHITE))
+
+        else:
+            for dx, dy in SLIDING_DIRECTIONS[PIECE_TYPES[kind - 1]]:
+                new_row, new_col = row + dx, col + dy
+                while 0 <= new_row < 8 and 0 <= new_col < 8:
+                    target = squares[new_row * 8 + new_col]
+                    if not target:
+                        moves.append((new_row, new_col))  # Empty square
+                    else:
+                        if target & BLACK_BIT != own:
+                            moves.append((new_row, new_col))  # Capture
+                        break  # Blocked by another piece
+                    new_row += dx
+                    new_col += dy
+
+        return moves
+
+    def castling_moves(self, row, col, color):
+        """Return the king's castling targets; the landing square is left to the legality check."""
+        kingside, queenside = CASTLING_RIGHTS[color]
+        squares = self.squares
+        base = row * 8
+        rook = PIECE_CODES[('rook', color)]
+        enemy = opponent(color)
+        moves = []
+        if (row, col) != (HOME_ROW[color], 4) or self.is_square_attacked(row, col, enemy):
+            return moves
+        if (self.castling & kingside and not squares[base + 5] and not squares[base + 6]
+                and squares[base + 7] == rook and not self.is_square_attacked(row, 5, enemy)):
+            moves.append((row, 6))
+        if (self.castling & queenside and not squares[base + 1] and not squares[base + 2] and not squares[base + 3]
+                and squares[base] == rook and not self.is_square_attacked(row, 3, enemy)):
+            moves.append((row, 2))
+        return moves
+
+    def scan_kings(self):
+        """Search the board for both kings; put() and make_move() keep self.kings current after this."""
+        kings = {WHITE: None, BLACK: None}
+        for sq, code in enumerate(self.squares):
+            if code & 7 == KING:
+                kings[CODE_COLORS[code]] = (sq >> 3, sq & 7)
+        return kings
+
+    def find_king(self, color):
+        """Return the (row, col) of the king of the given color, or None."""
+        return self.kings[color]
+
+    def is_square_attacked(self, row, col, by_color):
+        """Check if any piece of by_color attacks (row, col), looking outward from the square."""
+        squares = self.squares
+        by_bit = BLACK_BIT if by_color == BLACK else 0
+        for steps, attacker in ((KNIGHT_STEPS, KNIGHT | by_bit), (KING_STEPS, KING | by_bit)):
+            for dx, dy in steps:
+                new_row, new_col = row + dx, col + dy
+                if 0 <= new_row < 8 and 0 <= new_col < 8 and squares[new_row * 8 + new_col] == attacker:
+                    return True
+
+        # Pawns capture diagonally forwards, so look one row behind the square from their side
+        pawn_row = row + 1 if by_color == WHITE else row - 1
+        if 0 <= pawn_row < 8:
+            for new_col in (col - 1, col + 1):
+                if 0 <= new_col < 8 and squares[pawn_row * 8 + new_col] == PAWN | by_bit:
+                    return True
+
+        queen = QUEEN | by_bit
+        for directions, slider in ((ROOK_DIRECTIONS, ROOK | by_bit), (BISHOP_DIRECTIONS, BISHOP | by_bit)):
+            for dx, dy in directions:
+                new_row, new_col = row + dx, col + dy
+                while 0 <= new_row < 8 and 0 <= new_col < 8:
+                    code = squares[new_row * 8 + new_col]
+                    if code:
+                        if code == slider or code == queen:
+                            return True
+                        break  # Blocked by another piece
+                    new_row += dx
+                    new_col += dy
+        return False
+
+    def is_king_in_check(self, color):
+        """Check if the king of the specified color is in check."""
+        king_pos = self.kings[color]
+        return king_pos is not None and self.is_square_attacked(*king_pos, opponent(color))
+
+    def legal_piece_moves(self, row, col):
+        """Return the squares the piece on (row, col) can move to without leaving its king in check."""
+        squares = self.squares
+        start = row * 8 + col
+        code = squares[start]
+        color = CODE_COLORS[code]
+        enemy = opponent(color)
+        king_pos = self.kings[color]
+        legal = []
+        for new_row, new_col in self.piece_moves(row, col):
+            # An en passant capture removes a pawn beside the start square instead
+            end = new_row * 8 + new_col
+            captured_sq = start - col + new_col if code & 7 == PAWN and (new_row, new_col) == self.ep_square else end
+            captured = squares[captured_sq]
+            squares[captured_sq] = 0
+            squares[end] = code
+            squares[start] = 0
+            target = (new_row, new_col) if code & 7 == KING else king_pos
+            if target is None or not self.is_square_attacked(*target, enemy):
+                legal.append((new_row, new_col))
+            squares[start] = code
+            squares[end] = 0
+            squares[captured_sq] = captured
+        return legal
+
+    def has_legal_move(self):
+        """Return True if the side to move has a legal move, stopping at the first piece that can move."""
+        own = BLACK_BIT if self.turn == BLACK else 0
+        king = self.kings[self.turn]
+        # The king is tried first as it is the piece most likely to have a move when in check
+        if king is not None and self.legal_piece_moves(*king):
+            return True
+        for sq, code in enumerate(self.squares):
+            if code and code & BLACK_BIT == own and code & 7 != KING and self.legal_piece_moves(sq >> 3, sq & 7):
+                return True
+        return False
+
+    def legal_moves(self):
+        """Return every legal Move for the side to move, with one entry per promotion choice."""
+        moves = []
+        own = BLACK_BIT if self.turn == BLACK else 0
+        for sq, code in enumerate(self.squares):
+            if not code or code & BLACK_BIT != own:
+                continue
+            row, col = sq >> 3, sq & 7
+            for end in self.legal_piece_moves(row, col):
+                if code & 7 == PAWN and end[0] in (0, 7):
+                    moves.extend(Move((row, col), end, promotion) for promotion in PROMOTION_PIECES)
+                else:
+                    moves.append(Move((row, col), end, None))
+        return moves
+
+    def make_move(self, move):
+        """Apply a move, pass the turn to the other side and push an undo record.
+
+        The move is not checked for legality. A pawn moved to the last row
+        without a promotion stays a pawn, which lets the UI show it there while
+        the player picks a piece.
+        """
+        (row, col), (new_row, new_col), promotion = move
+        squares = self.squares
+        start = row * 8 + col
+        end = new_row * 8 + new_col
+        code = squares[start]
+        color = CODE_COLORS[code]
+        kind = code & 7
+        captured_sq = start - col + new_col if kind == PAWN and (new_row, new_col) == self.ep_square else end
+        captured = squares[captured_sq]
+        self.history.append((move, code, captured, captured_sq, self.castling, self.ep_square,
+                             self.halfmove_clock, self.key))
+
+        placed = PIECE_CODES[(promotion, color)] if promotion else code
+        key = self.key ^ self.ep_key() ^ CASTLING_KEYS[self.castling] ^ BLACK_TO_MOVE_KEY
+        key ^= CODE_KEYS[code][start] ^ CODE_KEYS[placed][end]
+        if captured:
+            key ^= CODE_KEYS[captured][captured_sq]
+
+        squares[captured_sq] = 0
+        squares[start] = 0
+        squares[end] = placed
+        if kind == KING:
+            self.kings[color] = (new_row, new_col)
+            rook = code - KING + ROOK
+            if new_col - col == 2:  # Castling kingside, bring the rook over
+                squares[start + 1], squares[start + 3] = rook, 0
+                key ^= CODE_KEYS[rook][start + 3] ^ CODE_KEYS[rook][start + 1]
+            elif col - new_col == 2:  # Castling queenside
+                squares[start - 1], squares[start - 4] = rook, 0
+                key ^= CODE_KEYS[rook][start - 4] ^ CODE_KEYS[rook][start - 1]
+        elif captured & 7 == KING:
+            self.kings[CODE_COLORS[captured]] = None
+
+        if self.castling:
+            self.castling &= ~(CASTLING_SQUARES.get((row, col), 0) | CASTLING_SQUARES.get((new_row, new_col), 0))
+        self.ep_square = ((row + new_row) // 2, col) if kind == PAWN and abs(new_row - row) == 2 else None
+        self.halfmove_clock = 0 if kind == PAWN or captured else self.halfmove_clock + 1
+        if color == BLACK:
+            self.fullmove_number += 1
+        self.turn = opponent(color)
+        self.key = key ^ CASTLING_KEYS[self.castling] ^ self.ep_key()
+        self.version += 1
+        self.bitboards = None
+
+    def unmake_move(self):
+        """Take back the last move made with make_move() and return it."""
+        move, code, captured, captured_sq, castling, ep_square, halfmove_clock, key = self.history.pop()
+        (row, col), (new_row, new_col), _ = move
+        squares = self.squares
+        start = row * 8 + col
+        color = CODE_COLORS[code]
+
+        squares[new_row * 8 + new_col] = 0
+        squares[captured_sq] = captured
+        squares[start] = code
+        if code & 7 == KING:
+            self.kings[color] = (row, col)
+            rook = code - KING + ROOK
+            if new_col - col == 2:
+                squares[start + 3], squares[start + 1] = rook, 0
+            elif col - new_col == 2:
+                squares[start - 4], squares[start - 1] = rook, 0
+        elif captured & 7 == KING:
+            self.kings[CODE_COLORS[captured]] = (captured_sq >> 3, captured_sq & 7)
+
+        self.castling = castling
+        self.ep_square = ep_square
+        self.halfmove_clock = halfmove_clock
+        if color == BLACK:
+            self.fullmove_number -= 1
+        self.turn = color
+        self.key = key
+        self.version += 1
+        self.bitboards = None
+        return move
+
+
+# Module-level rules API, shared with bitboard.py so either can back ChessBoard
+piece_moves = Position.piece_moves
+is_king_in_check = Position.is_king_in_check
+is_square_attacked = Position.is_square_attacked
+legal_piece_moves = Position.legal_piece_moves
+legal_moves = Position.legal_moves
+has_legal_move = Position.has_legal_move
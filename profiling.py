@@ -0,0 +1,148 @@
+"""Opt-in timings and call counts for ChessBoard.run, with an on-screen overlay and JSON/CSV dumps.
+
+Nothing here runs unless a Profiler is passed to ChessBoard: instrument()
+swaps the board's methods for timing and counting wrappers, so the plain
+methods carry no extra cost when profiling is off.
+"""
+import csv
+import json
+import os
+import time
+from collections import deque
+
+# Seconds spent per frame; total is the whole frame and draw_board includes its draw_piece calls
+SECTIONS = ('total', 'events', 'draw_board', 'draw_piece', 'promotion_popup', 'move_generation', 'display_update')
+# Calls per frame
+COUNTERS = ('highlight_moves', 'is_king_in_check', 'piece_moves', 'legal_piece_moves', 'legal_moves', 'has_legal_move')
+HISTORY_FRAMES = 600
+
+
+class InstrumentedRules:
+    """Stands in for a rules module, counting and timing its move generation calls."""
+
+    def __init__(self, rules, profiler):
+        self.rules = rules
+        self.profiler = profiler
+
+    def __getattr__(self, name):
+        attribute = getattr(self.rules, name)
+        if name in COUNTERS:
+            attribute = self.profiler.wrap(attribute, 'move_generation', name)
+        setattr(self, name, attribute)  # Wrap once; later lookups find the instance attribute
+        return attribute
+
+
+class Profiler:
+    """Collects per-frame section timings, call counts and engine search statistics."""
+
+    def __init__(self, path=None, interval=5.0, overlay=False):
+        self.path = path  # .json or .csv file written every interval seconds, or None
+        self.interval = interval
+        self.overlay = overlay
+        self.frames = deque(maxlen=HISTORY_FRAMES)
+        self.searches = deque(maxlen=HISTORY_FRAMES)
+        self.times = dict.fromkeys(SECTIONS, 0.0)
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.frame_number = 0
+        self.frame_start = time.perf_counter()
+        self.last_dump = self.frame_start
+        self.written = 0  # Frames already appended to a CSV dump
+
+    def wrap(self, function, section=None, counter=None):
+        """Return function wrapped to add its run time to a section and/or count its calls."""
+        times = self.times
+        counts = self.counts
+        clock = time.perf_counter
+
+        def wrapper(*args, **kwargs):
+            if counter:
+                counts[counter] += 1
+            if not section:
+                return function(*args, **kwargs)
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                times[section] += clock() - start
+
+        return wrapper
+
+    def instrument(self, board):
+        """Install timing and counting wrappers on a ChessBoard and its PieceManager."""
+        board.draw_board = self.wrap(board.draw_board, 'draw_board')
+        board.draw_promotion_popup = self.wrap(board.draw_promotion_popup, 'promotion_popup')
+        board.piece_manager.draw_piece = self.wrap(board.piece_manager.draw_piece, 'draw_piece')
+        board.highlight_moves = self.wrap(board.highlight_moves, counter='highlight_moves')
+        board.rules = InstrumentedRules(board.rules, self)  # Counts is_king_in_check and the move generators
+
+    def add_time(self, section, seconds):
+        self.times[section] += seconds
+
+    def start_frame(self):
+        self.frame_start = time.perf_counter()
+
+    def end_frame(self):
+        """Store the finished frame's numbers, reset them, and dump if the interval has passed."""
+        now = time.perf_counter()
+        self.times['total'] = now - self.frame_start
+        self.frame_number += 1
+        self.frames.append({'frame': self.frame_number, 'time': time.time(), **self.times, **self.counts})
+        for section in SECTIONS:
+            self.times[section] = 0.0
+        for counter in COUNTERS:
+            self.counts[counter] = 0
+        if self.path and now - self.last_dump >= self.interval:
+            self.dump()
+            self.last_dump = now
+
+    def record_search(self, result):
+        """Keep the statistics of an engine SearchResult."""
+        self.searches.append({'frame': self.frame_number, 'depth': result.depth, 'nodes': result.nodes,
+                              'seconds': result.seconds, 'nps': result.nps, 'score': result.score})
+
+    def summary(self):
+        """Return mean and max per section (in ms) and per counter over the kept frames, plus recent searches."""
+        frames = list(self.frames)
+        summary = {'frames': self.frame_number, 'sections_ms': {}, 'counts': {}, 'searches': list(self.searches)}
+        for section in SECTIONS:
+            values = [frame[section] * 1000 for frame in frames] or [0.0]
+            summary['sections_ms'][section] = {'mean': sum(values) / len(values), 'max': max(values)}
+        for counter in COUNTERS:
+            values = [frame[counter] for frame in frames] or [0]
+            summary['counts'][counter] = {'mean': sum(values) / len(values), 'max': max(values)}
+        return summary
+
+    def dump(self, path=None):
+        """Write the summary as JSON, or append the frames not yet written as CSV rows, by file extension."""
+        path = path or self.path
+        if path.endswith('.csv'):
+            new = [frame for frame in self.frames if frame['frame'] > self.written]
+            header = not os.path.exists(path)
+            with open(path, 'a', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=('frame', 'time') + SECTIONS + COUNTERS)
+                if header:
+                    writer.writeheader()
+                writer.writerows(new)
+            if new:
+                self.written = new[-1]['frame']
+        else:
+            with open(path, 'w') as f:
+                json.dump(self.summary(), f, indent=2)
+
+    def overlay_lines(self):
+        """Return short text lines describing the last frame, for the on-screen overlay."""
+        if not self.frames:
+            return ['no frames yet']
+        frame = self.frames[-1]
+        lines = [
+            f"frame {frame['frame']}: {frame['total'] * 1000:.1f} ms",
+            f"events {frame['events'] * 1000:.1f}  board {frame['draw_board'] * 1000:.1f}  "
+            f"pieces {frame['draw_piece'] * 1000:.1f}  popup {frame['promotion_popup'] * 1000:.1f}",
+            f"movegen {frame['move_generation'] * 1000:.1f} ms  update {frame['display_update'] * 1000:.1f} ms",
+            f"highlight {frame['highlight_moves']}  check {frame['is_king_in_check']}  "
+            f"piece_moves {frame['piece_moves']}",
+        ]
+        if self.searches:
+            search = self.searches[-1]
+            lines.append(f"search depth {search['depth']}  {search['nodes']} nodes  {search['nps']:.0f} nps")
+        return lines
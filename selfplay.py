@@ -0,0 +1,160 @@
+"""Play headless games between configurable players across a process pool.
+
+    python selfplay.py --games 100 --white engine:depth=2 --black random --pgn games.pgn
+    python selfplay.py --games 1000 --white random --black random --jsonl games.jsonl --workers 8
+
+Players are 'random', 'engine:depth=N' or 'engine:time=SECONDS'. Finished
+games are written as soon as they arrive, in completion order.
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+import bitboard
+import position
+from engine import Engine
+from pgn import format_game, move_san
+from position import Position
+from termination import game_over
+from zobrist import TranspositionTable
+
+RULES = {'position': position, 'bitboard': bitboard}
+MAX_PLIES = 400
+
+
+class RandomPlayer:
+    """Picks a uniformly random legal move."""
+
+    def __init__(self, rules, seed=None):
+        self.rules = rules
+        self.random = random.Random(seed)
+
+    def __call__(self, position):
+        return self.random.choice(self.rules.legal_moves(position))
+
+
+class EnginePlayer:
+    """Plays the engine's best move at a fixed depth or time per move."""
+
+    def __init__(self, rules, depth=None, time_limit=None):
+        self.engine = Engine(rules, TranspositionTable(1 << 16))
+        self.depth = depth or 64
+        self.time_limit = time_limit or float('inf')
+
+    def __call__(self, position):
+        return self.engine.search(position, self.time_limit, self.depth).move
+
+
+def make_player(spec, rules, seed=None):
+    """Build a player from a spec such as 'random', 'engine:depth=3' or 'engine:time=0.5'."""
+    kind, _, option = spec.partition(':')
+    if kind == 'random' and not option:
+        return RandomPlayer(rules, seed)
+    if kind == 'engine':
+        name, _, value = option.partition('=')
+        if name == 'depth':
+            return EnginePlayer(rules, depth=int(value))
+        if name == 'time':
+            return EnginePlayer(rules, time_limit=float(value))
+    raise ValueError(f'unknown player {spec!r}')
+
+
+def play_game(job):
+    """Play one game and return it as a dict; runs in a worker process."""
+    index, white, black, seed, max_plies, random_plies, rules_name = job
+    rules = RULES[rules_name]
+    players = {'white': make_player(white, rules, seed), 'black': make_player(black, rules, seed + 1)}
+    opening = RandomPlayer(rules, seed + 2)
+    game = Position.initial()
+    sans = []
+    start = time.perf_counter()
+    outcome = None
+    while len(sans) < max_plies:
+        outcome = game_over(rules, game)
+        if outcome:
+            break
+        player = opening if len(sans) < random_plies else players[game.turn]
+        move = player(game)
+        sans.append(move_san(game, move, rules))
+        game.make_move(move)
+    result, termination = outcome or ('*', 'ply limit')
+    return {
+        'index': index, 'white': white, 'black': black, 'seed': seed, 'result': result,
+        'termination': termination, 'plies': len(sans), 'moves': sans, 'fen': game.fen(),
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def jobs(args):
+    for index in range(args.games):
+        white, black = args.white, args.black
+        if args.alternate and index % 2:
+            white, black = black, white
+        yield index, white, black, args.seed + 3 * index, args.max_plies, args.random_plies, args.rules
+
+
+def pgn_text(game, date):
+    headers = {
+        'Event': 'Self-play', 'Site': '?', 'Date': date, 'Round': game['index'] + 1,
+        'White': game['white'], 'Black': game['black'], 'Result': game['result'],
+        'Termination': game['termination'], 'PlyCount': game['plies'],
+    }
+    return format_game(headers, game['moves'], game['result'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=10)
+    parser.add_argument('--white', default='engine:depth=2')
+    parser.add_argument('--black', default='random')
+    parser.add_argument('--alternate', action='store_true', help='swap colors every other game')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--max-plies', type=int, default=MAX_PLIES)
+    parser.add_argument('--random-plies', type=int, default=0, help='open every game with this many random plies')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rules', choices=RULES, default='bitboard')
+    parser.add_argument('--pgn', help='write games to this PGN file')
+    parser.add_argument('--jsonl', help='write games to this file, one JSON object per line')
+    args = parser.parse_args(argv)
+
+    for spec in (args.white, args.black):
+        make_player(spec, RULES[args.rules])  # Fail early on a bad spec, not in every worker
+
+    pgn_file = open(args.pgn, 'w') if args.pgn else None
+    jsonl_file = open(args.jsonl, 'w') if args.jsonl else None
+    date = datetime.date.today().strftime('%Y.%m.%d')
+    scores = {}
+    plies = 0
+    start = time.perf_counter()
+    try:
+        with multiprocessing.Pool(args.workers) as pool:
+            for count, game in enumerate(pool.imap_unordered(play_game, jobs(args)), 1):
+                if pgn_file:
+                    pgn_file.write(pgn_text(game, date))
+                    pgn_file.flush()
+                if jsonl_file:
+                    jsonl_file.write(json.dumps(game) + '\n')
+                    jsonl_file.flush()
+                scores[game['result']] = scores.get(game['result'], 0) + 1
+                plies += game['plies']
+                print(f"game {count}/{args.games}: {game['white']} - {game['black']} {game['result']} "
+                      f"({game['termination']}, {game['plies']} plies)", file=sys.stderr)
+    finally:
+        for f in (pgn_file, jsonl_file):
+            if f:
+                f.close()
+
+    seconds = time.perf_counter() - start
+    print(f"{args.games} games, {plies} plies in {seconds:.1f}s: {args.games * 3600 / seconds:.0f} games/hour, "
+          f"{plies / seconds:.0f} plies/s with {args.workers} workers", file=sys.stderr)
+    print('results: ' + ', '.join(f'{result} x{count}' for result, count in sorted(scores.items())), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
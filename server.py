@@ -0,0 +1,370 @@
+"""Host many concurrent games for remote clients from one asyncio process.
+
+    python server.py [--port 8765] [--workers 4] [--think-time 0.5]
+
+Clients talk newline-delimited JSON over TCP. Every request carries an "id"
+that is echoed in its reply:
+
+    {"id": 1, "op": "new", "engine": "black", "time": 300, "increment": 2}
+    {"id": 2, "op": "move", "game": 1, "move": "e2e4"}
+    {"id": 3, "op": "state", "game": 1}
+    {"id": 4, "op": "resign", "game": 1}
+    {"id": 5, "op": "close", "game": 1}
+    {"id": 6, "op": "stats"}
+
+Replies are {"id": ..., "ok": true, ...} or {"id": ..., "ok": false, "error": ...}.
+Engine moves, and games lost on time or ended by an engine failure (result
+"*"), are pushed as {"event": "move", ...} and {"event": "over", ...}.
+Searches run in a process pool so the event loop never blocks; a game between
+moves is only its packed position, the keys needed for repetition checks and
+its clocks, so idle games cost a few hundred bytes.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import bitboard
+import position
+from book import OpeningBook
+from engine import Engine
+from ingest import position_error
+from position import STARTING_FEN, WHITE, Position, move_uci, opponent, parse_uci
+from tablebase import Tablebases
+from termination import game_over
+from zobrist import TranspositionTable
+
+RULES = {'position': position, 'bitboard': bitboard}
+DEFAULT_TIME = 300.0  # Seconds per side
+SWEEP_SECONDS = 0.5  # How often running clocks are checked for a flag fall
+MOVES_TO_GO = 30  # The engine spends at most its remaining time divided by this on a move
+MAX_GAMES = 100000
+
+# Engine of each pool process, built once by _init_engine
+_engine = None
+
+
+def _init_engine(rules_name, table_size, book_path, tablebase_dir):
+    global _engine
+    _engine = Engine(RULES[rules_name], TranspositionTable(table_size),
+                     book=OpeningBook(book_path) if book_path else None,
+                     tablebases=Tablebases(tablebase_dir) if tablebase_dir else None)
+
+
+def engine_move(state, time_limit):
+    """Search a packed position and return the best Move; runs in a pool process."""
+    return _engine.search(Position.from_bytes(state), time_limit).move
+
+
+class Game:
+    """One hosted game, kept compact while nobody is moving in it."""
+
+    __slots__ = ('id', 'owner', 'state', 'keys', 'clocks', 'increment', 'turn_started', 'engine_color',
+                 'think_time', 'plies', 'result', 'termination')
+
+    def __init__(self, game_id, owner, start, clocks, increment, engine_color, think_time, now):
+        self.id = game_id
+        self.owner = owner  # StreamWriter of the connection that made the game
+        self.state = start.to_bytes()
+        # Keys of the earlier positions since the last capture or pawn move, for repetition checks
+        self.keys = array('Q')
+        self.clocks = clocks  # [white, black] seconds left at the start of the current turn
+        self.increment = increment
+        self.turn_started = now
+        self.engine_color = engine_color
+        self.think_time = think_time
+        self.plies = 0
+        self.result = None
+        self.termination = None
+
+
+class GameServer:
+    """Keeps the hosted games, answers requests and hands engine turns to a process pool."""
+
+    def __init__(self, rules=bitboard, pool=None, think_time=0.5, max_games=MAX_GAMES):
+        self.rules = rules
+        self.pool = pool
+        self.think_time = think_time
+        self.max_games = max_games
+        self.games = {}
+        self.next_id = 1
+        self.searches = 0  # Engine searches queued or running
+        self.connections = 0
+
+    def clock_left(self, game, now):
+        """Return [white, black] seconds left, counting the running clock down to now."""
+        clocks = list(game.clocks)
+        if game.result is None:
+            side = side_to_move(game)
+            clocks[side] -= now - game.turn_started
+        return clocks
+
+    def outcome(self, game, position):
+        """Return (result, termination) if the game ended on the board, otherwise None."""
+        return game_over(self.rules, position, game.keys.count(position.key) + 1)
+
+    def finish(self, game, result, termination):
+        game.result = result
+        game.termination = termination
+        send(game.owner, {'event': 'over', 'game': game.id, 'result': result, 'termination': termination})
+
+    def check_flag(self, game, now):
+        """End the game on time if the side to move has run out; return True if it has."""
+        if game.result is None:
+            side = side_to_move(game)
+            if game.clocks[side] - (now - game.turn_started) <= 0:
+                game.clocks[side] = 0.0
+                self.finish(game, '0-1' if side == 0 else '1-0', 'time forfeit')
+        return game.result is not None
+
+    def play(self, game, board, move, now):
+        """Make a legal move in the game, charge the mover's clock and start the engine if it is to reply."""
+        side = board.turn != WHITE
+        game.clocks[side] += game.increment - (now - game.turn_started)
+        key = board.key
+        board.make_move(move)
+        if board.halfmove_clock:
+            game.keys.append(key)
+        else:
+            game.keys = array('Q')  # Nothing before a capture or pawn move can repeat
+        game.state = board.to_bytes()
+        game.turn_started = now
+        game.plies += 1
+        ended = self.outcome(game, board)
+        if ended:
+            game.result, game.termination = ended
+        elif board.turn == game.engine_color:
+            self.start_engine(game)
+
+    def start_engine(self, game):
+        side = side_to_move(game)
+        time_limit = max(0.01, min(game.think_time, game.clocks[side] / MOVES_TO_GO))
+        self.searches += 1
+        plies = game.plies
+        future = asyncio.get_running_loop().run_in_executor(self.pool, engine_move, game.state, time_limit)
+        future.add_done_callback(lambda done: self.engine_done(game, plies, done))
+
+    def engine_done(self, game, plies, future):
+        """Play the engine's move unless the game was closed or changed while it searched."""
+        self.searches -= 1
+        if future.cancelled() or self.games.get(game.id) is not game or game.plies != plies:
+            return
+        now = asyncio.get_running_loop().time()
+        if self.check_flag(game, now):
+            return
+        try:
+            move = future.result()
+        except Exception as e:
+            print(f"engine failed in game {game.id}: {e!r}", file=sys.stderr)
+            self.finish(game, '*', 'engine error')  # Otherwise the game would wait for the engine forever
+            return
+        board = Position.from_bytes(game.state)
+        self.play(game, board, move, now)
+        send(game.owner, {'event': 'move', 'game': game.id, 'move': move_uci(move), **self.describe(game, now, board)})
+
+    def describe(self, game, now, board=None):
+        """Return the reply fields for a game; board is its current position when the caller has it."""
+        board = board or Position.from_bytes(game.state)
+        description = {'fen': board.fen(), 'clocks': self.clock_left(game, now)}
+        if game.result:
+            description.update(result=game.result, termination=game.termination)
+        return description
+
+    def find(self, request, owner):
+        game = self.games.get(field(request, 'game', int))
+        if game is None or game.owner is not owner:
+            raise ValueError('unknown game')
+        return game
+
+    def op_new(self, request, owner, now):
+        if len(self.games) >= self.max_games:
+            raise ValueError('server full')
+        engine_color = request.get('engine')
+        if engine_color not in (None, 'white', 'black'):
+            raise ValueError('engine must be white, black or null')
+        if engine_color and self.pool is None:
+            raise ValueError('this server has no engine')
+        seconds = float(field(request, 'time', (int, float), DEFAULT_TIME))
+        increment = float(field(request, 'increment', (int, float), 0.0))
+        think_time = min(field(request, 'think', (int, float), self.think_time), self.think_time)
+        if seconds <= 0 or increment < 0 or think_time <= 0:
+            raise ValueError('time and think must be positive and increment not negative')
+        try:
+            start = Position.from_fen(field(request, 'fen', str, STARTING_FEN))
+        except (IndexError, KeyError):
+            raise ValueError('bad fen')
+        error = position_error(self.rules, start)
+        if error:
+            raise ValueError(f"impossible position: {error}")
+        game = Game(self.next_id, owner, start, [seconds, seconds], increment, engine_color, think_time, now)
+        self.next_id += 1
+        self.games[game.id] = game
+        ended = self.outcome(game, start)
+        if ended:
+            game.result, game.termination = ended
+        elif start.turn == engine_color:
+            self.start_engine(game)
+        return {'game': game.id, **self.describe(game, now, start)}
+
+    def op_move(self, request, owner, now):
+        game = self.find(request, owner)
+        if self.check_flag(game, now) or game.result:
+            raise ValueError('game is over')
+        board = Position.from_bytes(game.state)
+        if board.turn == game.engine_color:
+            raise ValueError('not your turn')
+        move = parse_uci(field(request, 'move', str))
+        if move not in self.rules.legal_moves(board):
+            raise ValueError(f"illegal move {request.get('move')}")
+        self.play(game, board, move, now)
+        return self.describe(game, now, board)
+
+    def op_state(self, request, owner, now):
+        game = self.find(request, owner)
+        self.check_flag(game, now)
+        return self.describe(game, now)
+
+    def op_resign(self, request, owner, now):
+        game = self.find(request, owner)
+        if not self.check_flag(game, now) and game.result is None:
+            game.clocks = self.clock_left(game, now)
+            loser = Position.from_bytes(game.state).turn if game.engine_color is None else opponent(game.engine_color)
+            game.result, game.termination = ('0-1' if loser == WHITE else '1-0'), 'resignation'
+        return self.describe(game, now)
+
+    def op_close(self, request, owner, now):
+        game = self.find(request, owner)
+        del self.games[game.id]
+        return {}
+
+    def op_stats(self, request, owner, now):
+        return {'games': len(self.games), 'searches': self.searches, 'connections': self.connections}
+
+    def handle(self, request, owner, owned):
+        """Answer one decoded request and return the reply."""
+        if not isinstance(request, dict):
+            return {'id': None, 'ok': False, 'error': 'bad request'}
+        reply = {'id': request.get('id')}
+        handler = getattr(self, f"op_{request.get('op')}", None)
+        if handler is None:
+            reply.update(ok=False, error='unknown op')
+            return reply
+        try:
+            reply.update(handler(request, owner, asyncio.get_running_loop().time()))
+        except ValueError as e:
+            reply.update(ok=False, error=str(e))
+            return reply
+        except (TypeError, AttributeError, IndexError, KeyError) as e:
+            # Whatever slipped past the field checks fails this request, not the connection and its games
+            print(f"bad request {request!r}: {e!r}", file=sys.stderr)
+            reply.update(ok=False, error='bad request')
+            return reply
+        if 'game' in reply and reply['game'] in self.games:
+            owned.add(reply['game'])
+        reply['ok'] = True
+        return reply
+
+    async def serve_client(self, reader, writer):
+        owned = set()  # Games made on this connection, dropped when it closes
+        self.connections += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    request = None
+                send(writer, self.handle(request, writer, owned))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            for game_id in owned:
+                self.games.pop(game_id, None)
+            writer.close()
+
+    async def sweep_clocks(self):
+        """End games whose running clock has reached zero, so clients hear of it without asking."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(SWEEP_SECONDS)
+            now = loop.time()
+            for game in list(self.games.values()):
+                if game.result is None:
+                    self.check_flag(game, now)
+
+
+def field(request, name, types, default=None):
+    """Return a request field checked against types, or default when it is missing or null.
+
+    Floats must be finite: JSON parsing lets NaN and Infinity through, and a
+    NaN clock never runs out.
+    """
+    value = request.get(name)
+    if value is None:
+        if default is None:
+            raise ValueError(f"{name} is required")
+        return default
+    if not isinstance(value, types) or isinstance(value, bool):
+        raise ValueError(f"bad {name}")
+    if isinstance(value, float) and not math.isfinite(value):
+        raise ValueError(f"bad {name}")
+    return value
+
+
+def side_to_move(game):
+    """Return 0 if white is to move in the game and 1 if black is, read from the packed position's flags."""
+    return game.state[64] & 1
+
+
+def send(writer, message):
+    if not writer.is_closing():
+        writer.write(json.dumps(message, separators=(',', ':')).encode() + b'\n')
+
+
+async def serve(host, port, server):
+    listener = await asyncio.start_server(server.serve_client, host, port, backlog=1024)
+    sweeper = asyncio.create_task(server.sweep_clocks())
+    print(f"serving games on {', '.join(str(sock.getsockname()) for sock in listener.sockets)}", file=sys.stderr)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        sweeper.cancel()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--rules', choices=RULES, default='bitboard')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='engine processes (0 for no engine)')
+    parser.add_argument('--think-time', type=float, default=0.5, help='most seconds the engine spends on a move')
+    parser.add_argument('--table-size', type=int, default=1 << 16, help='transposition table entries per engine process')
+    parser.add_argument('--book', help='opening book made with book.py')
+    parser.add_argument('--tablebases', help='directory of endgame tables made with tablebase.py')
+    parser.add_argument('--max-games', type=int, default=MAX_GAMES)
+    args = parser.parse_args(argv)
+
+    pool = ProcessPoolExecutor(args.workers, initializer=_init_engine,
+                               initargs=(args.rules, args.table_size, args.book, args.tablebases)) if args.workers else None
+    server = GameServer(RULES[args.rules], pool, args.think_time, args.max_games)
+    try:
+        asyncio.run(serve(args.host, args.port, server))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
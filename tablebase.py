@@ -0,0 +1,495 @@
+"""Endgame tablebases: retrograde generation, a compact index-addressed file format, and probing.
+
+    python tablebase.py generate KQvK KRvK KPvK [--dir tablebases] [--workers 8]
+    python tablebase.py probe --fen "8/8/8/8/8/2k5/8/KQ6 w - - 0 1" [--dir tablebases]
+
+A table holds one byte per index. Each position is first turned by a board
+symmetry so the white king stands on files a-d, and for pawnless material in
+the a1-d1-d4 triangle. The two kings then share one number among the pairs
+left (462 without pawns, 1806 with), and every other piece is numbered among
+the squares not yet taken, so the index is
+(side * pairs + pair) * 62 * 61 * ... + the other pieces' numbers. That makes
+a 3-piece table 57 KB without pawns, a 4-piece one 3.5 MB and a 5-piece one
+210 MB, and a probe is a few table lookups and one read from a memory map.
+Tables are built with the stronger side as white; positions with the colours
+the other way round are probed in the mirrored table.
+
+Bytes are from the side to move's point of view: 0 draw, 1-127 mate in that
+many moves, 128-254 mated in (byte - 128) moves, 255 an impossible position.
+Castling and en passant are not part of tablebase positions.
+
+Generation keeps about 16 bytes per index and 8 bytes per move inside the
+table in memory: a few megabytes for 3 pieces, around 500 MB and ten CPU
+minutes for a pawnless 4-piece table and about four times that with a pawn.
+It stops at MAX_GENERATED_PIECES; 5-piece tables are not supported.
+"""
+import argparse
+import collections
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import time
+from array import array
+
+import bitboard
+from position import BLACK, BLACK_BIT, CODE_LETTERS, LETTER_CODES, PAWN, PIECE_CODES, WHITE, Position, opponent
+
+DRAW = 0
+LOSS = 128  # LOSS + n: the side to move is mated in n moves
+INVALID = 255
+HEADER = struct.Struct('<4s16sB')  # magic, material spec, piece count
+MAGIC = b'CTB2'
+PIECE_ORDER = 'KQRBNP'
+# Material where neither side can ever mate, so no table is needed
+DRAWN_SPECS = {'KvK', 'KBvK', 'KNvK', 'KvKB', 'KvKN'}
+MAX_GENERATED_PIECES = 4
+CHUNKS_PER_WORKER = 8
+
+
+def _transform(square, symmetry):
+    """Apply one of the eight board symmetries: bit 0 mirrors files, bit 1 ranks, bit 2 the a1-h8 diagonal."""
+    if symmetry & 1:
+        square ^= 7
+    if symmetry & 2:
+        square ^= 56
+    if symmetry & 4:
+        square = 63 - (square & 7) * 8 - (square >> 3)
+    return square
+
+
+# SYMMETRIES[s][square] is the square it maps to; only the first two keep pawns moving the same way
+SYMMETRIES = [bytes(_transform(square, symmetry) for square in range(64)) for symmetry in range(8)]
+
+
+def _canonical_kings(white_king, black_king, pawns):
+    """Whether a king pair is one the index keeps: the white king on files a-d, and without pawns on a1-d1-d4."""
+    rank, file = 7 - (white_king >> 3), white_king & 7
+    if file > 3:
+        return False
+    if pawns or rank < file:
+        return True
+    # On the diagonal itself the black king decides, so it must not be above the diagonal
+    return rank == file and 7 - (black_king >> 3) <= (black_king & 7)
+
+
+def _king_pairs(pawns):
+    """Return the kept king pairs, and for every (white king, black king) its pair number and symmetry."""
+    pairs = [(white_king, black_king) for white_king in range(64) for black_king in range(64)
+             if max(abs((white_king >> 3) - (black_king >> 3)), abs((white_king & 7) - (black_king & 7))) > 1
+             and _canonical_kings(white_king, black_king, pawns)]
+    numbers = {pair: number for number, pair in enumerate(pairs)}
+    pair_numbers = array('h', [-1] * 4096)  # -1 for kings on the same or neighbouring squares
+    pair_symmetries = bytearray(4096)
+    for white_king in range(64):
+        for black_king in range(64):
+            for symmetry, mapping in enumerate(SYMMETRIES[:2] if pawns else SYMMETRIES):
+                number = numbers.get((mapping[white_king], mapping[black_king]))
+                if number is not None:
+                    pair_numbers[white_king * 64 + black_king] = number
+                    pair_symmetries[white_king * 64 + black_king] = symmetry
+                    break
+    return pairs, pair_numbers, pair_symmetries
+
+
+# Keyed by whether the material has pawns
+KING_PAIRS = {pawns: _king_pairs(pawns) for pawns in (False, True)}
+
+
+def table_size(count, pawns):
+    """Return the number of indexes in a table of count pieces."""
+    size = 2 * len(KING_PAIRS[pawns][0])
+    for placed in range(2, count):
+        size *= 64 - placed
+    return size
+
+
+def square_index(squares, black_to_move, pawns):
+    """Return the table index for the pieces' squares in table order, kings first."""
+    pairs, pair_numbers, pair_symmetries = KING_PAIRS[pawns]
+    kings = squares[0] * 64 + squares[1]
+    mapping = SYMMETRIES[pair_symmetries[kings]]
+    index = (len(pairs) if black_to_move else 0) + pair_numbers[kings]
+    placed = [mapping[squares[0]], mapping[squares[1]]]
+    for square in squares[2:]:
+        square = mapping[square]
+        index = index * (64 - len(placed)) + square - sum(1 for other in placed if other < square)
+        placed.append(square)
+    return index
+
+
+def index_squares(index, count, pawns):
+    """Return the squares in table order and whether black is to move for a table index."""
+    pairs = KING_PAIRS[pawns][0]
+    numbers = []
+    for placed in range(count - 1, 1, -1):
+        index, number = divmod(index, 64 - placed)
+        numbers.append(number)
+    black_to_move, pair = divmod(index, len(pairs))
+    squares = list(pairs[pair])
+    for number in reversed(numbers):
+        for other in sorted(squares):
+            if other <= number:
+                number += 1
+        squares.append(number)
+    return squares, bool(black_to_move)
+
+
+def canonical_spec(white, black):
+    """Return the spec for two strings of piece letters, strongest first: ('KRQ', 'K') -> 'KQRvK'."""
+    return ''.join(sorted(white, key=PIECE_ORDER.index)) + 'v' + ''.join(sorted(black, key=PIECE_ORDER.index))
+
+
+def oriented_spec(spec):
+    """Return the canonical spec with the stronger side as white, the way tables are built: 'KvKR' -> 'KRvK'."""
+    white, black = spec.upper().split('V')
+
+    def strength(letters):
+        return len(letters), sorted(-PIECE_ORDER.index(letter) for letter in letters)[::-1]
+
+    if strength(black) > strength(white):
+        white, black = black, white
+    return canonical_spec(white, black)
+
+
+def spec_codes(spec):
+    """Return the piece codes of a spec in table order: kings first, then white's and black's other pieces."""
+    white, black = spec.upper().split('V')
+    if white.count('K') != 1 or black.count('K') != 1:
+        raise ValueError(f"Bad tablebase material {spec!r}")
+    white_codes = [LETTER_CODES[letter] for letter in white.replace('K', '', 1)]
+    black_codes = [LETTER_CODES[letter.lower()] for letter in black.replace('K', '', 1)]
+    return [LETTER_CODES['K'], LETTER_CODES['k']] + white_codes + black_codes
+
+
+def code_spec(codes):
+    """Return the canonical spec for a list of piece codes."""
+    white = ''.join(CODE_LETTERS[code] for code in codes if not code & BLACK_BIT)
+    black = ''.join(CODE_LETTERS[code].upper() for code in codes if code & BLACK_BIT)
+    return canonical_spec(white, black)
+
+
+def value_plies(value):
+    """Return the distance to mate in plies, positive when the side to move wins, or None for a draw."""
+    if value == DRAW or value == INVALID:
+        return None
+    return 2 * value - 1 if value < LOSS else -2 * (value - LOSS)
+
+
+class Tablebase:
+    """One memory-mapped table file."""
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, spec, count = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            raise ValueError(f"Not a tablebase file: {path!r}")
+        self.spec = spec.rstrip(b'\0').decode()
+        self.codes = spec_codes(self.spec)
+        self.pawns = any(code & 7 == PAWN for code in self.codes)
+        self.size = table_size(count, self.pawns)
+        if len(self.data) != HEADER.size + self.size:
+            raise ValueError(f"Truncated tablebase file: {path!r}")
+        # (code, n) for each slot in table order: the slot holds the n-th piece with that code
+        self.slots = [(code, self.codes[:slot].count(code)) for slot, code in enumerate(self.codes)]
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def lookup(self, pieces, black_to_move):
+        """Return the stored byte for pieces, a dict from piece code to the squares holding it."""
+        squares = [pieces[code][n] for code, n in self.slots]
+        return self.data[HEADER.size + square_index(squares, black_to_move, self.pawns)]
+
+
+class Tablebases:
+    """All tables in a directory, looked up by the material on the board."""
+
+    def __init__(self, directory):
+        self.tables = {}
+        for name in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+            if name.endswith('.tb'):
+                table = Tablebase(os.path.join(directory, name))
+                self.tables[table.spec] = table
+        self.max_pieces = max((len(table.codes) for table in self.tables.values()), default=0)
+
+    def __len__(self):
+        return len(self.tables)
+
+    def lookup(self, pieces, black_to_move):
+        """Return the table byte for pieces (piece code -> squares), or None when no table covers them.
+
+        Material held the other way round from a table is looked up with the
+        colours swapped and the board turned upside down; bytes are from the
+        side to move's point of view, so the answer needs no change.
+        """
+        white = ''.join(CODE_LETTERS[code] * len(squares) for code, squares in pieces.items() if not code & BLACK_BIT)
+        black = ''.join(CODE_LETTERS[code].upper() * len(squares) for code, squares in pieces.items()
+                        if code & BLACK_BIT)
+        table = self.tables.get(canonical_spec(white, black))
+        if table is None:
+            table = self.tables.get(canonical_spec(black, white))
+            if table is None:
+                return None
+            pieces = {code ^ BLACK_BIT: [square ^ 56 for square in squares] for code, squares in pieces.items()}
+            black_to_move = not black_to_move
+        return table.lookup(pieces, black_to_move)
+
+    def probe(self, position):
+        """Return the table byte for the position, or None when no table covers its material."""
+        boards = bitboard.bitboards(position)
+        if (boards.occupied[0] | boards.occupied[1]).bit_count() > self.max_pieces:
+            return None
+        pieces = {}
+        for color, side in enumerate(boards.pieces):
+            for piece_type, bits in enumerate(side):
+                squares = []
+                while bits:
+                    low = bits & -bits
+                    squares.append(low.bit_length() - 1)
+                    bits ^= low
+                if squares:
+                    pieces[piece_type + 1 + (BLACK_BIT if color else 0)] = squares
+        return self.lookup(pieces, position.turn == BLACK)
+
+
+def child_value(tables, codes, squares, black_to_move):
+    """Look up the value of a position that left the current table through a capture or promotion."""
+    if code_spec(codes) in DRAWN_SPECS:
+        return DRAW
+    pieces = {}
+    for code, square in zip(codes, squares):
+        pieces.setdefault(code, []).append(square)
+    return tables.lookup(pieces, black_to_move)
+
+
+_worker_tables = {}
+
+
+def expand_chunk(job):
+    """Generate moves for a range of indexes; runs in a worker process.
+
+    Returns the range start and, per index: a status byte (0 impossible,
+    1 legal, 2 legal and in check), the number of in-table successors, 1 if a
+    capture or promotion draws or wins, the plies of the quickest mate such a
+    move gives (0 for none) and the longest mate the opponent gets from those
+    that lose. The successor indexes follow in index order.
+    """
+    spec, directory, start, stop = job
+    if directory not in _worker_tables:
+        _worker_tables[directory] = Tablebases(directory)
+    tables = _worker_tables[directory]
+    codes = spec_codes(spec)
+    n = len(codes)
+    pawns = any(code & 7 == PAWN for code in codes)
+    status = bytearray(stop - start)
+    counts = array('H', bytes(2 * (stop - start)))
+    escapes = bytearray(stop - start)
+    quickest = array('H', bytes(2 * (stop - start)))
+    longest = array('H', bytes(2 * (stop - start)))
+    successors = array('I')
+
+    for offset, index in enumerate(range(start, stop)):
+        squares, black_to_move = index_squares(index, n, pawns)
+        turn = BLACK if black_to_move else WHITE
+        board = bytearray(64)
+        bad = False
+        for code, square in zip(codes, squares):
+            if code & 7 == PAWN and square >> 3 in (0, 7):
+                bad = True  # Pawns never stand on the first or last rank
+            board[square] = code
+        if bad:
+            continue
+        position = Position(board, turn)
+        if bitboard.is_king_in_check(position, opponent(turn)):
+            continue  # The side that just moved cannot have left its king in check
+        status[offset] = 2 if bitboard.is_king_in_check(position, turn) else 1
+
+        slots = {square: slot for slot, square in enumerate(squares)}
+        count = 0
+        for move in bitboard.legal_moves(position):
+            end_square = move.end[0] * 8 + move.end[1]
+            slot = slots[move.start[0] * 8 + move.start[1]]
+            captured = slots.get(end_square)
+            child_squares = list(squares)
+            child_squares[slot] = end_square
+            if captured is None and move.promotion is None:
+                successors.append(square_index(child_squares, not black_to_move, pawns))
+                count += 1
+                continue
+            child_codes = list(codes)
+            if move.promotion is not None:
+                child_codes[slot] = PIECE_CODES[(move.promotion, turn)]
+            if captured is not None:
+                del child_codes[captured], child_squares[captured]
+            value = child_value(tables, child_codes, child_squares, not black_to_move)
+            if value == DRAW or value == INVALID:
+                escapes[offset] = 1
+            elif value >= LOSS:
+                escapes[offset] = 1
+                plies = 2 * (value - LOSS) + 1
+                if not quickest[offset] or plies < quickest[offset]:
+                    quickest[offset] = plies
+            else:
+                longest[offset] = max(longest[offset], 2 * value - 1)
+        counts[offset] = count
+    return start, status, counts, escapes, quickest, longest, successors
+
+
+def children_specs(spec):
+    """Return the specs reachable from spec by one capture or promotion."""
+    white, black = spec.split('v')
+    found = set()
+    for side, other, is_white in ((white, black, True), (black, white, False)):
+        for i, letter in enumerate(other):
+            if letter != 'K':
+                rest = other[:i] + other[i + 1:]
+                found.add(canonical_spec(side, rest) if is_white else canonical_spec(rest, side))
+        if 'P' in side:
+            for promoted in 'QRBN':
+                changed = side.replace('P', promoted, 1)
+                found.add(canonical_spec(changed, other) if is_white else canonical_spec(other, changed))
+    return found
+
+
+def generate(spec, directory, workers=None, log=None):
+    """Build the table for spec, and any tables it depends on, into directory; return its path."""
+    spec = oriented_spec(spec)
+    path = os.path.join(directory, spec + '.tb')
+    if spec in DRAWN_SPECS or os.path.exists(path):
+        return path
+    codes = spec_codes(spec)
+    if len(codes) > MAX_GENERATED_PIECES:
+        raise ValueError(f"Cannot generate {spec}: tables of more than {MAX_GENERATED_PIECES} pieces are not supported")
+    for child in sorted(children_specs(spec)):
+        generate(child, directory, workers, log)
+
+    workers = workers or os.cpu_count()
+    started = time.perf_counter()
+    pawns = any(code & 7 == PAWN for code in codes)
+    size = table_size(len(codes), pawns)
+    status = bytearray(size)
+    remaining = array('H', bytes(2 * size))  # Successors not yet known to win for the opponent
+    escapes = bytearray(size)  # 1 when a capture or promotion draws or wins
+    longest = array('H', bytes(2 * size))  # Longest opponent win among successors and losing exits
+    buckets = collections.defaultdict(list)
+    edges = array('I')  # Successors of each index, in index order
+    chunk = -(-size // (workers * CHUNKS_PER_WORKER))
+    jobs = [(spec, directory, start, min(start + chunk, size)) for start in range(0, size, chunk)]
+    with multiprocessing.Pool(workers) as pool:
+        for start, *chunk_arrays, chunk_successors in pool.imap(expand_chunk, jobs):
+            chunk_status, chunk_counts, chunk_escapes, chunk_quickest, chunk_longest = chunk_arrays
+            stop = start + len(chunk_status)
+            status[start:stop] = chunk_status
+            remaining[start:stop] = chunk_counts
+            escapes[start:stop] = chunk_escapes
+            longest[start:stop] = chunk_longest
+            edges.extend(chunk_successors)
+            for offset, plies in enumerate(chunk_quickest):
+                if plies:
+                    buckets[plies].append(start + offset)
+
+    # Predecessor lists as one flat array with offsets
+    offsets = array('I', bytes(4 * (size + 1)))
+    for child in edges:
+        offsets[child + 1] += 1
+    for index in range(size):
+        offsets[index + 1] += offsets[index]
+    predecessors = array('I', bytes(4 * len(edges)))
+    fill = array('I', offsets)
+    position_in_edges = 0
+    for source in range(size):
+        for _ in range(remaining[source]):
+            child = edges[position_in_edges]
+            predecessors[fill[child]] = source
+            fill[child] += 1
+            position_in_edges += 1
+    del edges, fill
+
+    # Retrograde pass in order of distance to mate, in plies
+    for index in range(size):
+        if status[index] and not remaining[index] and not escapes[index]:
+            if longest[index]:
+                buckets[longest[index] + 1].append(index)  # Every capture or promotion loses
+            elif status[index] == 2:
+                buckets[0].append(index)  # Checkmated
+
+    values = bytearray(size)
+    for index in range(size):
+        if not status[index]:
+            values[index] = INVALID
+    decided = bytearray(size)
+    plies = 0
+    while buckets:
+        for index in buckets.pop(plies, []):
+            if decided[index]:
+                continue
+            decided[index] = 1
+            if plies % 2 == 0:
+                values[index] = LOSS + plies // 2
+                for parent in predecessors[offsets[index]:offsets[index + 1]]:
+                    if not decided[parent]:
+                        buckets[plies + 1].append(parent)
+            else:
+                values[index] = (plies + 1) // 2
+                for parent in predecessors[offsets[index]:offsets[index + 1]]:
+                    if not decided[parent]:
+                        remaining[parent] -= 1
+                        if plies > longest[parent]:
+                            longest[parent] = plies
+                        if not remaining[parent] and not escapes[parent]:
+                            buckets[longest[parent] + 1].append(parent)
+        plies += 1
+
+    os.makedirs(directory, exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(HEADER.pack(MAGIC, spec.encode(), len(codes)))
+        f.write(values)
+    os.replace(path + '.tmp', path)
+    if log:
+        wins = [value for value in values if 0 < value < LOSS]
+        log(f"{spec}: {sum(1 for s in status if s)} positions, {len(wins)} wins, longest mate {max(wins, default=0)} moves, "
+            f"{time.perf_counter() - started:.1f}s")
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate_parser = commands.add_parser('generate', help='build tables by retrograde analysis')
+    generate_parser.add_argument('specs', nargs='+', help='material such as KQvK, KRvK or KPvK')
+    generate_parser.add_argument('--dir', default='tablebases')
+    generate_parser.add_argument('--workers', type=int, default=os.cpu_count())
+
+    probe_parser = commands.add_parser('probe', help='look up a position')
+    probe_parser.add_argument('--fen', required=True)
+    probe_parser.add_argument('--dir', default='tablebases')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        os.makedirs(args.dir, exist_ok=True)
+        for spec in args.specs:
+            generate(spec, args.dir, args.workers, log=print)
+        return 0
+
+    value = Tablebases(args.dir).probe(Position.from_fen(args.fen))
+    if value is None:
+        print('no table for this material')
+        return 1
+    plies = value_plies(value)
+    if value == INVALID:
+        print('impossible position')
+    elif plies is None:
+        print('draw')
+    else:
+        print(f"{'win' if plies > 0 else 'loss'}: mate in {abs(plies)} plies")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
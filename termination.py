@@ -0,0 +1,46 @@
+"""Decide whether a game has ended: mate, stalemate, the fifty-move rule, repetition or dead material.
+
+game_over() is cheap enough to call after every move: mate and stalemate
+stop at the first legal move found, repetitions are counted from the
+position's Zobrist keys back to the last capture or pawn move, and the
+material test usually stops at the first pawn, rook or queen it meets.
+"""
+from position import BISHOP, KNIGHT, PAWN, QUEEN, ROOK, WHITE
+
+FIFTY_MOVES = 100  # Plies without a capture or pawn move
+MATING_MATERIAL = (PAWN, ROOK, QUEEN)
+
+
+def insufficient_material(position):
+    """Return True if neither side can ever mate: bare kings, one minor piece, or only bishops on one square color."""
+    minors = []
+    for sq, code in enumerate(position.squares):
+        kind = code & 7
+        if kind in MATING_MATERIAL:
+            return False
+        if kind == KNIGHT or kind == BISHOP:
+            minors.append((kind, ((sq >> 3) + (sq & 7)) & 1))
+    if len(minors) <= 1:
+        return True
+    # Any number of bishops that all run on the same square color can never mate
+    return all(kind == BISHOP for kind, _ in minors) and len({shade for _, shade in minors}) == 1
+
+
+def game_over(rules, position, repetitions=None):
+    """Return (result, termination) if the game has ended, otherwise None.
+
+    repetitions is how often the position has occurred, for callers that
+    track it themselves; by default it is read from the position's history.
+    """
+    if not rules.has_legal_move(position):
+        if rules.is_king_in_check(position, position.turn):
+            return ('0-1' if position.turn == WHITE else '1-0'), 'checkmate'
+        return '1/2-1/2', 'stalemate'
+    if position.halfmove_clock >= FIFTY_MOVES:
+        return '1/2-1/2', 'fifty-move rule'
+    if (repetitions or position.repetition_count()) >= 3:
+        return '1/2-1/2', 'threefold repetition'
+    if insufficient_material(position):
+        return '1/2-1/2', 'insufficient material'
+    return None
+
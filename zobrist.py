@@ -0,0 +1,96 @@
+"""Zobrist position keys and a fixed-size transposition table."""
+import random
+from array import array
+
+PIECE_NAMES = ('pawn', 'knight', 'bishop', 'rook', 'queen', 'king')
+
+_random = random.Random(20240611)  # Fixed seed so keys are the same in every process
+
+
+def _key():
+    return _random.getrandbits(64)
+
+
+# One key per (piece_type, color) and square index row * 8 + col
+PIECE_KEYS = {(name, color): [_key() for _ in range(64)] for color in ('white', 'black') for name in PIECE_NAMES}
+CASTLING_KEYS = [0] + [_key() for _ in range(15)]  # Indexed by the castling rights bit mask
+EP_KEYS = [_key() for _ in range(8)]  # By file of a capturable en passant square
+BLACK_TO_MOVE_KEY = _key()
+
+
+class TranspositionTable:
+    """Fixed-size table of (key, depth, value) entries indexed by the low bits of the key.
+
+    A new entry replaces the one in its slot when the slot holds the same key,
+    was written during an older generation, or was searched less deeply.
+    Call new_generation() at the start of each search so stale entries give way.
+    """
+
+    def __init__(self, size=1 << 16):
+        size = 1 << max(size - 1, 1).bit_length()  # Round up to a power of two
+        self.mask = size - 1
+        self.keys = array('Q', bytes(8 * size))
+        self.depths = array('b', [-1]) * size
+        self.generations = array('H', bytes(2 * size))
+        self.values = [None] * size
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.replacements = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def probe(self, key):
+        """Return (depth, value) stored for the key, or None."""
+        index = key & self.mask
+        if self.depths[index] >= 0 and self.keys[index] == key:
+            self.hits += 1
+            return self.depths[index], self.values[index]
+        self.misses += 1
+        return None
+
+    def get(self, key, default=None):
+        """Return the value stored for the key, or default."""
+        entry = self.probe(key)
+        return default if entry is None else entry[1]
+
+    def store(self, key, value, depth=0):
+        """Store a value unless the slot holds a deeper entry from the current generation."""
+        index = key & self.mask
+        old_depth = self.depths[index]
+        if old_depth >= 0 and self.keys[index] != key:
+            if self.generations[index] == self.generation and old_depth > depth:
+                return False
+            self.replacements += 1
+        self.keys[index] = key
+        self.depths[index] = min(depth, 127)
+        self.generations[index] = self.generation
+        self.values[index] = value
+        self.stores += 1
+        return True
+
+    def new_generation(self):
+        self.generation = (self.generation + 1) & 0xFFFF
+
+    def clear(self):
+        size = len(self.values)
+        self.keys = array('Q', bytes(8 * size))
+        self.depths = array('b', [-1]) * size
+        self.generations = array('H', bytes(2 * size))
+        self.values = [None] * size
+        self.hits = self.misses = self.stores = self.replacements = 0
+
+    def stats(self):
+        """Return the hit/miss counters and fill level as a dict."""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.values),
+            'filled': sum(1 for depth in self.depths if depth >= 0),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'stores': self.stores,
+            'replacements': self.replacements,
+        }